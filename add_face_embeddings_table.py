@@ -1,30 +1,280 @@
-import sqlite3
+import json
+from itertools import islice
+
+import face_index
+from db import close_conn, get_conn
+
+from embeddings import (
+    EMBEDDING_BYTES,
+    blob_to_embedding,
+    embedding_sha,
+    embedding_to_blob,
+    normalize_embedding,
+    quantize_embedding,
+)
 
 DB_PATH = "clinic.db"
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+INSERT_EMBEDDING_SQL = """
+    INSERT OR IGNORE INTO patient_face_embeddings (
+        patient_id, embedding_blob, embedding_norm, embedding_i8, scale,
+        zero_point, embedding_sha, created_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Rows handed to each executemany() call by merge_legacy_face_embeddings
+BULK_BATCH_SIZE = 500
+
+
+def migrate_json_to_blob(conn, table):
+    """
+    Convert a table's legacy embedding_json TEXT column into embedding_blob
+    (packed float32). Returns the number of rows converted; no-op if the
+    table has already been migrated.
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if "embedding_json" not in columns:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        conn.execute(
+            f"""
+            ALTER TABLE {table} ADD COLUMN embedding_blob BLOB
+                CHECK (length(embedding_blob) = {EMBEDDING_BYTES})
+            """
+        )
+        rows = conn.execute(
+            f"SELECT embedding_id, embedding_json FROM {table}"
+        ).fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET embedding_blob = ? WHERE embedding_id = ?",
+            [
+                (embedding_to_blob(json.loads(embedding_json)), embedding_id)
+                for embedding_id, embedding_json in rows
+            ],
+        )
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN embedding_json")
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return len(rows)
+
+
+def add_int8_embeddings(conn, table="patient_face_embeddings"):
+    """
+    Add the int8 quantized columns (embedding_i8, scale, zero_point) if they
+    are missing and backfill them from embedding_blob. Returns rows filled.
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if "embedding_blob" not in columns:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        for name, decl in (
+            ("embedding_i8", "BLOB"),
+            ("scale", "REAL"),
+            ("zero_point", "REAL"),
+        ):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+        rows = conn.execute(
+            f"""
+            SELECT embedding_id, embedding_blob FROM {table}
+            WHERE embedding_i8 IS NULL
+            """
+        ).fetchall()
+        conn.executemany(
+            f"""
+            UPDATE {table} SET embedding_i8 = ?, scale = ?, zero_point = ?
+            WHERE embedding_id = ?
+            """,
+            [
+                (*quantize_embedding(blob_to_embedding(blob)), embedding_id)
+                for embedding_id, blob in rows
+            ],
+        )
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return len(rows)
+
+
+def add_embedding_sha(conn, table="patient_face_embeddings"):
+    """
+    Add and backfill the embedding_sha column, drop rows that duplicate an
+    earlier embedding of the same patient, and build the unique index.
+    Returns the number of duplicate rows removed.
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if "embedding_blob" not in columns or "embedding_sha" in columns:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN embedding_sha BLOB")
+        rows = conn.execute(
+            f"SELECT embedding_id, embedding_blob FROM {table}"
+        ).fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET embedding_sha = ? WHERE embedding_id = ?",
+            [(embedding_sha(blob), embedding_id) for embedding_id, blob in rows],
+        )
+        removed = conn.execute(
+            f"""
+            DELETE FROM {table}
+            WHERE embedding_id NOT IN (
+                SELECT MIN(embedding_id) FROM {table}
+                GROUP BY patient_id, embedding_sha
+            )
+            """
+        ).rowcount
+        conn.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_face_unique
+                ON {table} (patient_id, embedding_sha)
+            """
+        )
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return removed
+
+
+def add_embedding_norms(conn, table="patient_face_embeddings"):
+    """
+    Add embedding_norm and rewrite every row to its unit vector (BLOB, int8
+    copy and hash). Rows that become duplicates of another embedding of the
+    same patient once normalized are dropped. Returns the number removed.
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if "embedding_sha" not in columns or "embedding_norm" in columns:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN embedding_norm REAL")
+        rows = conn.execute(
+            f"SELECT embedding_id, embedding_blob FROM {table}"
+        ).fetchall()
+        conn.executemany(
+            f"""
+            UPDATE OR IGNORE {table}
+            SET embedding_blob = ?, embedding_norm = ?, embedding_i8 = ?,
+                scale = ?, zero_point = ?, embedding_sha = ?
+            WHERE embedding_id = ?
+            """,
+            [
+                (*_embedding_columns(blob_to_embedding(blob)), embedding_id)
+                for embedding_id, blob in rows
+            ],
+        )
+        removed = conn.execute(
+            f"DELETE FROM {table} WHERE embedding_norm IS NULL"
+        ).rowcount
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return removed
 
-    # Create table if it doesn't exist
-    cur.execute(
+
+def migrate_face_embeddings(conn):
+    """Run every embedding migration step; each one is a no-op when done."""
+    converted = migrate_json_to_blob(conn, "patient_face_embeddings")
+    quantized = add_int8_embeddings(conn)
+    duplicates = add_embedding_sha(conn)
+    duplicates += add_embedding_norms(conn)
+    return converted, quantized, duplicates
+
+
+def _embedding_columns(embedding):
+    """(embedding_blob, embedding_norm, embedding_i8, scale, zero_point, embedding_sha)."""
+    unit, norm = normalize_embedding(embedding)
+    blob = embedding_to_blob(unit)
+    embedding_i8, scale, zero_point = quantize_embedding(unit)
+    return blob, norm, embedding_i8, scale, zero_point, embedding_sha(blob)
+
+
+def _embedding_params(patient_id, embedding, created_at):
+    """Parameters for INSERT_EMBEDDING_SQL."""
+    return (patient_id, *_embedding_columns(embedding), created_at)
+
+
+def _insert_embedding_batches(conn, rows):
+    """executemany() INSERT_EMBEDDING_SQL in BULK_BATCH_SIZE chunks; returns rows written."""
+    params = (_embedding_params(*row) for row in rows)
+    written = 0
+    while batch := list(islice(params, BULK_BATCH_SIZE)):
+        written += conn.executemany(INSERT_EMBEDDING_SQL, batch).rowcount
+    return written
+
+
+def merge_legacy_face_embeddings(conn):
+    """
+    Move rows from the old standalone face_embeddings table into
+    patient_face_embeddings and drop it. Returns the number of rows moved.
+    """
+    tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    if "face_embeddings" not in tables or "patient_face_embeddings" not in tables:
+        return 0
+
+    migrate_json_to_blob(conn, "face_embeddings")
+    rows = conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS face_embeddings (
-            embedding_id   INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id     INTEGER NOT NULL,
-            embedding_json TEXT NOT NULL,
-            created_at     TEXT NOT NULL,
-            FOREIGN KEY (patient_id) REFERENCES patients(patient_id)
-        );
+        SELECT patient_id, embedding_blob, created_at
+        FROM face_embeddings
+        WHERE patient_id IN (SELECT patient_id FROM patients)
         """
-    )
-
-    # Optional: ensure one embedding per patient (if you want)
-    # This is just a comment; logic will be in code.
+    ).fetchall()
 
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        moved = _insert_embedding_batches(
+            conn,
+            (
+                (patient_id, blob_to_embedding(blob), created_at)
+                for patient_id, blob, created_at in rows
+            ),
+        )
+        conn.execute("DROP TABLE face_embeddings")
+    except Exception:
+        conn.rollback()
+        raise
     conn.commit()
-    conn.close()
-    print("face_embeddings table is ready.")
+    return moved
+
+
+def main():
+    conn = get_conn()
+
+    converted, quantized, duplicates = migrate_face_embeddings(conn)
+    print(f"patient_face_embeddings: converted {converted} JSON embeddings to float32 BLOBs.")
+    print(f"patient_face_embeddings: quantized {quantized} embeddings to int8.")
+    print(f"patient_face_embeddings: removed {duplicates} duplicate embeddings.")
+
+    # patient_face_embeddings (create_db.py) is the only embedding table
+    moved = merge_legacy_face_embeddings(conn)
+    print(f"face_embeddings: moved {moved} rows into patient_face_embeddings.")
+
+    if face_index.build_index(conn, face_index.faiss_index_path(DB_PATH)) is not None:
+        print("FAISS face index rebuilt.")
+    face_index.save_bank(*face_index.load_embedding_matrix(conn), DB_PATH)
+    print("Embedding bank sidecars rewritten.")
+
+    # Embedding rows and indexes changed; give the planner fresh statistics
+    conn.execute("ANALYZE;")
+
+    close_conn()
+    print("patient_face_embeddings table is ready.")
 
 if __name__ == "__main__":
     main()
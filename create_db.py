@@ -1,11 +1,21 @@
+import re
 import sqlite3
 from pathlib import Path
+from typing import List
 
-DB_PATH = "clinic.db"
+from db import SCHEMA_VERSION, configure_connection
+from embeddings import EMBEDDING_BYTES, EMBEDDING_DIM
+from face_index import remove_sidecars
+from add_face_embeddings_table import (
+    merge_legacy_face_embeddings,
+    migrate_face_embeddings,
+)
 
-schema = """
-PRAGMA foreign_keys = ON;
+DB_PATH = "clinic.db"
 
+# Tables are STRICT: column types are enforced rather than advisory. The
+# embedding sizes come from embeddings.py, so the CHECK cannot drift from it.
+schema_tables = f"""
 -- ===============================
 -- PATIENTS
 -- ===============================
@@ -19,8 +29,8 @@ CREATE TABLE IF NOT EXISTS patients (
     email            TEXT,
     address          TEXT,
     photo_path       TEXT,                 -- optional path to stored face image
-    created_at       TEXT DEFAULT (datetime('now'))
-);
+    created_at       TEXT NOT NULL         -- bound by the writer, see db.utc_now()
+) STRICT;
 
 -- ===============================
 -- ENCOUNTERS (VISITS)
@@ -34,9 +44,9 @@ CREATE TABLE IF NOT EXISTS encounters (
     history_of_present_illness TEXT,
     doctor_name               TEXT,
     disposition               TEXT,               -- 'Discharged', 'Admitted', etc.
-    created_at                TEXT DEFAULT (datetime('now')),
+    created_at                TEXT NOT NULL,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- CHRONIC & PAST MEDICAL CONDITIONS
@@ -52,7 +62,7 @@ CREATE TABLE IF NOT EXISTS medical_conditions (
     is_active      INTEGER DEFAULT 1, -- 1 = active, 0 = inactive
     notes          TEXT,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- SURGERIES / PROCEDURES
@@ -65,7 +75,7 @@ CREATE TABLE IF NOT EXISTS surgeries (
     complications  TEXT,
     notes          TEXT,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- MEDICATIONS (CURRENT + PAST)
@@ -83,7 +93,7 @@ CREATE TABLE IF NOT EXISTS medications (
     prescribed_by  TEXT,
     notes          TEXT,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- ALLERGIES & ADVERSE REACTIONS
@@ -98,7 +108,7 @@ CREATE TABLE IF NOT EXISTS allergies (
     is_active     INTEGER DEFAULT 1,
     notes         TEXT,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- FAMILY HISTORY
@@ -111,7 +121,7 @@ CREATE TABLE IF NOT EXISTS family_history (
     age_at_diagnosis  INTEGER,
     notes             TEXT,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- SOCIAL HISTORY (CURRENT SNAPSHOT)
@@ -125,9 +135,9 @@ CREATE TABLE IF NOT EXISTS social_history (
     drug_use          TEXT,
     occupation        TEXT,
     living_situation  TEXT,           -- 'Lives alone', 'With family'
-    last_updated      TEXT DEFAULT (datetime('now')),
+    last_updated      TEXT NOT NULL,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- IMMUNIZATIONS
@@ -141,7 +151,7 @@ CREATE TABLE IF NOT EXISTS immunizations (
     lot_number       TEXT,
     notes            TEXT,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
 -- ===============================
 -- VITAL SIGNS (PER ENCOUNTER)
@@ -160,7 +170,7 @@ CREATE TABLE IF NOT EXISTS vitals (
     height_cm         REAL,
     notes             TEXT,
     FOREIGN KEY(encounter_id) REFERENCES encounters(encounter_id)
-);
+) STRICT;
 
 -- ===============================
 -- LAB RESULTS (PER ENCOUNTER)
@@ -175,7 +185,7 @@ CREATE TABLE IF NOT EXISTS lab_results (
     result_date      TEXT,
     notes            TEXT,
     FOREIGN KEY(encounter_id) REFERENCES encounters(encounter_id)
-);
+) STRICT;
 
 -- ===============================
 -- DIAGNOSES PER ENCOUNTER
@@ -189,7 +199,7 @@ CREATE TABLE IF NOT EXISTS encounter_diagnoses (
     is_primary             INTEGER DEFAULT 0, -- 1 = primary diagnosis
     notes                  TEXT,
     FOREIGN KEY(encounter_id) REFERENCES encounters(encounter_id)
-);
+) STRICT;
 
 -- ===============================
 -- FACE EMBEDDINGS FOR FACE SEARCH
@@ -197,38 +207,39 @@ CREATE TABLE IF NOT EXISTS encounter_diagnoses (
 CREATE TABLE IF NOT EXISTS patient_face_embeddings (
     embedding_id   INTEGER PRIMARY KEY AUTOINCREMENT,
     patient_id     INTEGER NOT NULL,
-    embedding_json TEXT NOT NULL,       -- e.g. "[0.123, -0.045, ...]"
-    created_at     TEXT DEFAULT (datetime('now')),
+    embedding_blob BLOB NOT NULL        -- {EMBEDDING_DIM} x little-endian float32, unit length
+        CHECK (length(embedding_blob) = {EMBEDDING_BYTES}),
+    embedding_norm REAL NOT NULL,       -- L2 norm of the embedding before normalizing
+    embedding_i8   BLOB,                -- {EMBEDDING_DIM} x int8, v ~= scale * (q - zero_point)
+    scale          REAL,
+    zero_point     REAL,
+    embedding_sha  BLOB NOT NULL,       -- blake2b-128 of embedding_blob
+    created_at     TEXT NOT NULL,
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-);
+) STRICT;
 
--- ===============================
--- USEFUL INDEXES
--- ===============================
-CREATE INDEX IF NOT EXISTS idx_encounters_patient
-    ON encounters (patient_id);
+-- One row per distinct embedding per patient (writers use INSERT OR IGNORE).
+-- This is a constraint rather than a lookup index, so it is never deferred.
+CREATE UNIQUE INDEX IF NOT EXISTS ux_face_unique
+    ON patient_face_embeddings (patient_id, embedding_sha);
 
-CREATE INDEX IF NOT EXISTS idx_medical_conditions_patient_active
-    ON medical_conditions (patient_id, is_active);
-
-CREATE INDEX IF NOT EXISTS idx_medications_patient_active
-    ON medications (patient_id, is_active);
-
-CREATE INDEX IF NOT EXISTS idx_allergies_patient_active
-    ON allergies (patient_id, is_active);
-
-CREATE INDEX IF NOT EXISTS idx_vitals_encounter
-    ON vitals (encounter_id);
-
-CREATE INDEX IF NOT EXISTS idx_lab_results_encounter
-    ON lab_results (encounter_id);
-
-CREATE INDEX IF NOT EXISTS idx_face_embeddings_patient
-    ON patient_face_embeddings (patient_id);
+-- Bulk-enrollment staging table from earlier versions; nothing loads it
+DROP TABLE IF EXISTS patient_face_embeddings_stage;
 
 -- ===============================
--- PATIENT SUMMARY VIEW
+-- PATIENT SUMMARY (MATERIALIZED)
 -- ===============================
+-- Semicolon-separated lists of key clinical info, one row per patient.
+-- Kept current by the triggers in schema_summary, so reads are a single
+-- primary-key lookup instead of three aggregations.
+CREATE TABLE IF NOT EXISTS patient_summary_cache (
+    patient_id         INTEGER PRIMARY KEY,
+    active_conditions  TEXT,
+    active_medications TEXT,
+    active_allergies   TEXT
+) STRICT;
+
+-- Read-only view kept for API compatibility
 DROP VIEW IF EXISTS patient_summary;
 
 CREATE VIEW patient_summary AS
@@ -241,40 +252,263 @@ SELECT
     p.phone_number,
     p.email,
     p.address,
-    -- Semicolon-separated lists of key clinical info
-    (
-        SELECT GROUP_CONCAT(mc.name, '; ')
-        FROM medical_conditions mc
-        WHERE mc.patient_id = p.patient_id
-          AND mc.is_active = 1
-    ) AS active_conditions,
-    (
-        SELECT GROUP_CONCAT(m.drug_name || 
-                            CASE WHEN m.dose IS NOT NULL THEN ' ' || m.dose ELSE '' END, '; ')
-        FROM medications m
-        WHERE m.patient_id = p.patient_id
-          AND m.is_active = 1
-    ) AS active_medications,
-    (
-        SELECT GROUP_CONCAT(a.allergen || 
-                            CASE WHEN a.severity IS NOT NULL THEN ' (' || a.severity || ')' ELSE '' END, '; ')
-        FROM allergies a
-        WHERE a.patient_id = p.patient_id
-          AND a.is_active = 1
-    ) AS active_allergies
-FROM patients p;
+    c.active_conditions,
+    c.active_medications,
+    c.active_allergies
+FROM patients p
+LEFT JOIN patient_summary_cache c ON c.patient_id = p.patient_id;
+"""
+
+# Child table -> (patient_summary_cache column, aggregate over active rows)
+SUMMARY_SOURCES = {
+    "medical_conditions": (
+        "active_conditions",
+        "GROUP_CONCAT(name, '; ')",
+    ),
+    "medications": (
+        "active_medications",
+        "GROUP_CONCAT(drug_name || "
+        "CASE WHEN dose IS NOT NULL THEN ' ' || dose ELSE '' END, '; ')",
+    ),
+    "allergies": (
+        "active_allergies",
+        "GROUP_CONCAT(allergen || "
+        "CASE WHEN severity IS NOT NULL THEN ' (' || severity || ')' ELSE '' END, '; ')",
+    ),
+}
+
+
+def _summary_refresh_sql(table: str, ref: str) -> str:
+    """Recompute one cache column for the patient of trigger row NEW/OLD."""
+    column, aggregate = SUMMARY_SOURCES[table]
+    return f"""
+    INSERT INTO patient_summary_cache (patient_id, {column})
+    VALUES ({ref}.patient_id, (
+        SELECT {aggregate} FROM {table}
+        WHERE patient_id = {ref}.patient_id AND is_active = 1
+    ))
+    ON CONFLICT(patient_id) DO UPDATE SET {column} = excluded.{column};"""
+
+
+def _build_schema_summary() -> str:
+    """Full rebuild of patient_summary_cache plus the triggers that maintain it."""
+    columns = ", ".join(column for column, _ in SUMMARY_SOURCES.values())
+    # One grouped pass per child table, joined on patient_id, rather than a
+    # correlated subquery per patient per column
+    selects = ",\n    ".join(
+        f"{table}_agg.{column}" for table, (column, _) in SUMMARY_SOURCES.items()
+    )
+    joins = "\n".join(
+        f"LEFT JOIN (\n"
+        f"    SELECT patient_id, {aggregate} AS {column}\n"
+        f"    FROM {table} WHERE is_active = 1 GROUP BY patient_id\n"
+        f") {table}_agg ON {table}_agg.patient_id = p.patient_id"
+        for table, (column, aggregate) in SUMMARY_SOURCES.items()
+    )
+    parts = [
+        "DELETE FROM patient_summary_cache;",
+        f"INSERT INTO patient_summary_cache (patient_id, {columns})\n"
+        f"SELECT p.patient_id,\n    {selects}\nFROM patients p\n{joins};",
+        "DROP TRIGGER IF EXISTS trg_patients_summary_delete;",
+        "CREATE TRIGGER trg_patients_summary_delete AFTER DELETE ON patients\n"
+        "BEGIN\n"
+        "    DELETE FROM patient_summary_cache WHERE patient_id = OLD.patient_id;\n"
+        "END;",
+    ]
+    for table in SUMMARY_SOURCES:
+        for event, refs in (
+            ("INSERT", ("NEW",)),
+            ("UPDATE", ("OLD", "NEW")),
+            ("DELETE", ("OLD",)),
+        ):
+            name = f"trg_{table}_summary_{event.lower()}"
+            body = "".join(_summary_refresh_sql(table, ref) for ref in refs)
+            parts.append(f"DROP TRIGGER IF EXISTS {name};")
+            parts.append(
+                f"CREATE TRIGGER {name} AFTER {event} ON {table}\n"
+                f"BEGIN{body}\nEND;"
+            )
+    return "\n\n".join(parts) + "\n"
+
+
+schema_summary = _build_schema_summary()
+
+# Secondary indexes are kept separate so bulk imports can load the tables
+# first and build each B-tree once at the end (see finalize_indexes).
+schema_indexes = """
+-- ===============================
+-- USEFUL INDEXES
+-- ===============================
+-- Patient search filters on date_of_birth and orders by name. The name
+-- filter is a '%...%' LIKE, which no index (LOWER() or not) can seek.
+CREATE INDEX IF NOT EXISTS idx_patients_dob
+    ON patients (date_of_birth);
+
+CREATE INDEX IF NOT EXISTS idx_patients_name
+    ON patients (last_name, first_name);
+
+-- Encounter, vitals and lab lists read newest first; these replace the
+-- single-column foreign-key indexes, which they cover as a prefix.
+DROP INDEX IF EXISTS idx_encounters_patient;
+DROP INDEX IF EXISTS idx_vitals_encounter;
+DROP INDEX IF EXISTS idx_lab_results_encounter;
+
+CREATE INDEX IF NOT EXISTS idx_encounters_patient_date
+    ON encounters (patient_id, encounter_date DESC);
+
+-- Conditions are only ever read with is_active = 1 (patient_summary), so a
+-- partial index skips historical rows entirely. Medications and allergies
+-- keep (patient_id, is_active): their list endpoints return inactive rows too.
+DROP INDEX IF EXISTS idx_medical_conditions_patient_active;
+
+CREATE INDEX IF NOT EXISTS idx_medical_conditions_patient_active
+    ON medical_conditions (patient_id)
+    WHERE is_active = 1;
+
+CREATE INDEX IF NOT EXISTS idx_medications_patient_active
+    ON medications (patient_id, is_active);
+
+CREATE INDEX IF NOT EXISTS idx_allergies_patient_active
+    ON allergies (patient_id, is_active);
+
+CREATE INDEX IF NOT EXISTS idx_vitals_encounter_recorded
+    ON vitals (encounter_id, recorded_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_lab_results_encounter_date
+    ON lab_results (encounter_id, result_date DESC);
+
+-- Face search walks embeddings in (patient_id, embedding_id) order;
+-- replaces the old single-column idx_face_embeddings_patient.
+DROP INDEX IF EXISTS idx_face_embeddings_patient;
+
+CREATE INDEX IF NOT EXISTS idx_face_emb_cover
+    ON patient_face_embeddings (patient_id, embedding_id, created_at);
 """
 
-def create_database(db_path: str = DB_PATH):
-    """Create the SQLite database and all tables/views."""
+
+def split_statements(script: str) -> List[str]:
+    """Split a SQL script into complete statements.
+
+    Uses sqlite3.complete_statement so string literals and trigger bodies
+    containing ';' are kept intact.
+    """
+    statements = []
+    buffer = ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ""
+    return statements
+
+
+# Parsed once at import; create_database() may run on every app start.
+_TABLE_STMTS = tuple(split_statements(schema_tables + schema_summary))
+_INDEX_STMTS = tuple(split_statements(schema_indexes))
+_INDEX_NAMES = tuple(re.findall(r"CREATE INDEX IF NOT EXISTS (\w+)", schema_indexes))
+
+
+def _run_ddl(conn: sqlite3.Connection, statements):
+    """Run DDL statements inside one explicit transaction.
+
+    executescript() commits before it runs and autocommits each statement,
+    so the statements are executed one by one between BEGIN and COMMIT.
+    """
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        for stmt in statements:
+            conn.execute(stmt)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# The patient_summary_cache triggers look rows up by (patient_id, is_active)
+# on every insert; without these each seeded row would scan its whole table.
+SUMMARY_INDEXES = (
+    "idx_medical_conditions_patient_active",
+    "idx_medications_patient_active",
+    "idx_allergies_patient_active",
+)
+
+
+def drop_indexes(conn: sqlite3.Connection):
+    """Drop the non-unique secondary indexes ahead of a bulk import.
+
+    UNIQUE indexes stay, since they enforce constraints, and so do the
+    SUMMARY_INDEXES the summary triggers read; finalize_indexes() rebuilds
+    the rest.
+    """
+    names = [
+        row[0]
+        for row in conn.execute(
+            """
+            SELECT name FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL
+              AND sql NOT LIKE 'CREATE UNIQUE%'
+            """
+        )
+        if row[0] not in SUMMARY_INDEXES
+    ]
+    _run_ddl(conn, [f"DROP INDEX {name}" for name in names])
+
+
+def finalize_indexes(conn: sqlite3.Connection):
+    """Build the secondary indexes; call once a bulk import has finished."""
+    _run_ddl(conn, _INDEX_STMTS)
+
+
+def missing_indexes(conn: sqlite3.Connection) -> List[str]:
+    """Secondary indexes from schema_indexes that the database does not have."""
+    present = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+    return [name for name in _INDEX_NAMES if name not in present]
+
+
+def _upgrade_schema(conn: sqlite3.Connection, db_file: Path, with_indexes: bool):
+    """Apply migrations and the full schema, then stamp SCHEMA_VERSION."""
+    # Bring older embedding tables up to date before the schema's
+    # indexes reference their new columns
+    migrate_face_embeddings(conn)
+    _run_ddl(conn, _TABLE_STMTS)
+    # Retire the duplicate face_embeddings table (version 2)
+    merge_legacy_face_embeddings(conn)
+    if with_indexes:
+        finalize_indexes(conn)
+    # Embeddings may have been rewritten; the FAISS and .npy sidecars are
+    # rebuilt from SQLite the next time they are opened
+    remove_sidecars(db_file)
+    # Stamp the version last so a failed upgrade is retried next time
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+
+def create_database(db_path: str = DB_PATH, with_indexes: bool = True):
+    """Create the SQLite database and all tables/views.
+
+    Pass with_indexes=False before a bulk import and call finalize_indexes()
+    afterwards, so rows are not inserted into every index one at a time.
+    """
     db_file = Path(db_path)
     conn = sqlite3.connect(db_file)
     try:
-        # Important: enable foreign keys for this connection
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.executescript(schema)
-        conn.commit()
-        print(f"Database created/updated at: {db_file.resolve()}")
+        # WAL is stored in the file header, so every later opener inherits it
+        conn.execute("PRAGMA journal_mode = WAL;")
+        configure_connection(conn)
+        user_version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        if user_version != SCHEMA_VERSION:
+            _upgrade_schema(conn, db_file, with_indexes)
+            print(f"Database created/updated at: {db_file.resolve()}")
+        elif with_indexes and missing_indexes(conn):
+            # The version is stamped before the indexes of a with_indexes=False
+            # load exist; one that died before finalize_indexes() lands here
+            finalize_indexes(conn)
+            print(f"Missing indexes rebuilt: {db_file.resolve()}")
+        else:
+            print(f"Database schema already at version {SCHEMA_VERSION}: {db_file.resolve()}")
+        # Let SQLite refresh planner statistics (sqlite_stat1) where useful
+        conn.execute("PRAGMA optimize;")
     finally:
         conn.close()
         print("Connection closed.")
@@ -0,0 +1,133 @@
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+DB_PATH = "clinic.db"
+
+# Stored in PRAGMA user_version; bump whenever the schema in create_db.py
+# changes so existing databases re-apply it on the next create_database()
+# call. Kept here so the API can check it without importing the schema script.
+SCHEMA_VERSION = 5
+
+# sqlite3 keeps compiled statements per connection, keyed by SQL text; a
+# long-lived connection with a roomy cache means each statement shape is
+# parsed once per process instead of once per call.
+STATEMENT_CACHE_SIZE = 256
+
+# Connections kept open by ConnectionPool (one per concurrent request)
+POOL_SIZE = 8
+# Seconds a caller waits for a free connection before giving up
+POOL_TIMEOUT = 10.0
+
+# Guards the shared connection; hold it for execute + fetch as one unit.
+lock = threading.RLock()
+_conn = None
+
+
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Apply the per-connection PRAGMAs every opener of the clinic DB should use.
+
+    journal_mode=WAL is persistent in the database file (set once by
+    create_database); the settings below are per-connection and must be
+    re-applied every time a connection is opened.
+    """
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA synchronous = NORMAL;")     # safe under WAL, no fsync per commit
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA cache_size = -65536;")      # 64 MB page cache
+    # Map up to 1 GB of the file so scans of patient_face_embeddings read
+    # pages in place instead of copying them into SQLite's page cache
+    conn.execute("PRAGMA mmap_size = 1073741824;")
+    conn.execute("PRAGMA cache_spill = 0;")
+    conn.execute("PRAGMA wal_autocheckpoint = 1000;")  # pages; keeps the -wal file bounded
+    return conn
+
+
+def utc_now() -> str:
+    """Current UTC time as 'YYYY-MM-DD HH:MM:SS' (the old datetime('now') format).
+
+    Writers compute this once per request or batch and bind it, instead of
+    having SQLite evaluate a column DEFAULT for every row.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now.isoformat(sep=" ", timespec="seconds")
+
+
+def connect(db_path=DB_PATH) -> sqlite3.Connection:
+    """Open a configured connection that may be handed between threads."""
+    conn = sqlite3.connect(
+        db_path,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row
+    return configure_connection(conn)
+
+
+def get_conn() -> sqlite3.Connection:
+    """Process-wide connection to the clinic DB, opened and configured once."""
+    global _conn
+    with lock:
+        if _conn is None:
+            _conn = connect(DB_PATH)
+        return _conn
+
+
+def close_conn():
+    global _conn
+    with lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+class ConnectionPool:
+    """Fixed set of open connections shared by request threads.
+
+    Connections are opened and configured once up front; get() blocks until
+    one is free and put() hands it back, rolling back anything left open.
+    """
+
+    def __init__(self, db_path=DB_PATH, size: int = POOL_SIZE):
+        self.size = size
+        self._idle = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(connect(db_path))
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+
+    def get(self, timeout: float = POOL_TIMEOUT) -> sqlite3.Connection:
+        """Check out a connection; raises queue.Empty after `timeout` seconds."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._stats_lock:
+                self.waits += 1
+            conn = self._idle.get(timeout=timeout)
+        with self._stats_lock:
+            self.checkouts += 1
+        return conn
+
+    def put(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def stats(self) -> dict:
+        idle = self._idle.qsize()
+        return {
+            "size": self.size,
+            "idle": idle,
+            "in_use": self.size - idle,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+        }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,57 @@
+import hashlib
+
+import numpy as np
+
+# Face embeddings are stored as packed little-endian float32 BLOBs;
+# create_db.py builds its length CHECK from EMBEDDING_BYTES.
+EMBEDDING_DIM = 512
+EMBEDDING_DTYPE = np.dtype("<f4")
+EMBEDDING_BYTES = EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize
+
+# Symmetric int8 copy of each embedding (v ~= scale * (q - zero_point)),
+# 4x smaller than float32 for bandwidth-bound scans.
+INT8_LEVELS = 127
+
+# Digest size of the per-row embedding hash used to reject duplicates.
+EMBEDDING_SHA_BYTES = 16
+
+
+def embedding_to_blob(embedding) -> bytes:
+    """Pack an embedding (list or array of floats) into a float32 BLOB."""
+    arr = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    if arr.shape != (EMBEDDING_DIM,):
+        raise ValueError(
+            f"Expected a {EMBEDDING_DIM}-d embedding, got shape {arr.shape}"
+        )
+    return arr.tobytes()
+
+
+def blob_to_embedding(blob: bytes) -> np.ndarray:
+    """Decode a stored BLOB into a read-only float32 array (no copy)."""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def normalize_embedding(embedding):
+    """Return (unit-length float32 vector, original L2 norm).
+
+    Rows store the unit vector so cosine similarity is a plain dot product;
+    the norm is kept alongside in case raw magnitudes are ever needed.
+    """
+    arr = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return (arr / norm if norm > 0 else arr), norm
+
+
+def embedding_sha(blob: bytes) -> bytes:
+    """BLAKE2b digest of a float32 BLOB; identical embeddings hash equal."""
+    return hashlib.blake2b(blob, digest_size=EMBEDDING_SHA_BYTES).digest()
+
+
+def quantize_embedding(embedding):
+    """Quantize an embedding to int8. Returns (blob, scale, zero_point)."""
+    arr = np.asarray(embedding, dtype=np.float32)
+    max_abs = float(np.max(np.abs(arr))) if arr.size else 0.0
+    scale = max_abs / INT8_LEVELS if max_abs > 0 else 1.0
+    q = np.clip(np.round(arr / scale), -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+    return q.tobytes(), scale, 0.0
+
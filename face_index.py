@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is optional; face search falls back to a full scan
+    faiss = None
+
+from embeddings import EMBEDDING_DIM, blob_to_embedding
+
+# SQLite stays the source of truth; this sidecar only narrows the candidates
+# that find_best_face_match re-scores exactly.
+FAISS_INDEX_PATH = "clinic.faiss"
+IVF_PQ_FACTORY = "IVF64,PQ16"
+# PQ16 trains 256 centroids per sub-quantizer and faiss wants ~39 points per
+# centroid; smaller banks use an exact flat index instead
+MIN_IVF_TRAIN_ROWS = 256 * 39
+IVF_NPROBE = 8
+
+
+def faiss_index_path(db_path) -> Path:
+    """Sidecar index file that belongs to a database (clinic.db -> clinic.faiss)."""
+    return Path(db_path).with_suffix(".faiss")
+
+
+def faiss_ids_path(index_path) -> Path:
+    """embedding_ids an index file was built from (clinic.faiss -> clinic.faiss_ids.npy)."""
+    return Path(index_path).with_suffix(".faiss_ids.npy")
+
+
+def bank_paths(db_path):
+    """
+    Sidecar .npy files holding the embedding bank: the matrix, its patient_ids
+    and the embedding_ids it was built from (clinic.emb.npy, clinic.ids.npy,
+    clinic.embedding_ids.npy).
+    """
+    db_path = Path(db_path)
+    return (
+        db_path.with_suffix(".emb.npy"),
+        db_path.with_suffix(".ids.npy"),
+        db_path.with_suffix(".embedding_ids.npy"),
+    )
+
+
+def sidecar_paths(db_path):
+    """Every file derived from a database's embeddings (FAISS index and bank)."""
+    index_path = faiss_index_path(db_path)
+    return (index_path, faiss_ids_path(index_path), *bank_paths(db_path))
+
+
+def remove_sidecars(db_path):
+    """Delete the sidecars so the next load rebuilds them from SQLite."""
+    for path in sidecar_paths(db_path):
+        path.unlink(missing_ok=True)
+
+
+def _tune(index):
+    if hasattr(index, "nprobe"):
+        index.nprobe = IVF_NPROBE
+    return index
+
+
+def embedding_ids(conn: sqlite3.Connection) -> np.ndarray:
+    """embedding_id of every stored row, in load_embedding_matrix's row order."""
+    rows = conn.execute(
+        """
+        SELECT embedding_id
+        FROM patient_face_embeddings
+        ORDER BY patient_id, embedding_id
+        """
+    ).fetchall()
+    return np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+
+def load_embedding_matrix(conn: sqlite3.Connection):
+    """
+    Return (embedding_ids[int64], patient_ids[int64], float32 matrix[N, D]);
+    rows are stored unit-length.
+    """
+    rows = conn.execute(
+        """
+        SELECT embedding_id, patient_id, embedding_blob
+        FROM patient_face_embeddings
+        ORDER BY patient_id, embedding_id
+        """
+    ).fetchall()
+    eids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    # One decode for the whole bank instead of one array per row
+    matrix = blob_to_embedding(b"".join(row[2] for row in rows))
+    return eids, ids, matrix.reshape(len(rows), EMBEDDING_DIM)
+
+
+def load_int8_matrix(conn: sqlite3.Connection):
+    """int8 matrix[N, D] of the quantized copies, in load_embedding_matrix's row order."""
+    rows = conn.execute(
+        """
+        SELECT embedding_i8
+        FROM patient_face_embeddings
+        ORDER BY patient_id, embedding_id
+        """
+    ).fetchall()
+    matrix = np.frombuffer(b"".join(row[0] for row in rows), dtype=np.int8)
+    return matrix.reshape(len(rows), EMBEDDING_DIM)
+
+
+def _save_npy(path: Path, arr: np.ndarray):
+    """np.save to a uniquely named temporary file, then atomically replace `path`."""
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+        try:
+            np.save(f, arr)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def _ids_match(path: Path, eids: np.ndarray) -> bool:
+    """True when the embedding_ids saved at `path` are exactly `eids`."""
+    return path.exists() and np.array_equal(np.load(path), eids)
+
+
+def save_bank(eids: np.ndarray, ids: np.ndarray, matrix: np.ndarray, db_path):
+    """
+    Write the bank sidecars. The embedding_ids go last: load_bank() only
+    trusts files whose embedding_ids match the table, so a write that stops
+    part-way is rebuilt rather than used.
+    """
+    emb_path, ids_path, eids_path = bank_paths(db_path)
+    _save_npy(emb_path, matrix)
+    _save_npy(ids_path, ids)
+    _save_npy(eids_path, eids)
+
+
+def load_bank(conn: sqlite3.Connection, db_path):
+    """
+    Return (patient_ids, matrix) with the matrix memory-mapped from the .npy
+    sidecar, (re)writing the sidecars from SQLite when they are missing or
+    were built from a different set of embedding rows.
+    """
+    emb_path, ids_path, eids_path = bank_paths(db_path)
+    if emb_path.exists() and ids_path.exists() and _ids_match(eids_path, embedding_ids(conn)):
+        ids = np.load(ids_path)
+        matrix = np.load(emb_path, mmap_mode="r")
+        if len(ids) == len(matrix):
+            return ids, matrix
+    eids, ids, matrix = load_embedding_matrix(conn)
+    save_bank(eids, ids, matrix, db_path)
+    return ids, np.load(emb_path, mmap_mode="r")
+
+
+def build_index(conn: sqlite3.Connection, path=FAISS_INDEX_PATH):
+    """
+    Build an inner-product index over every stored embedding (cosine on unit
+    vectors), keyed by patient_id, and write it to `path` along with the
+    embedding_ids it covers. Returns None when faiss is not installed or
+    there is nothing to index.
+    """
+    if faiss is None:
+        return None
+    eids, ids, matrix = load_embedding_matrix(conn)
+    if len(ids) == 0:
+        Path(path).unlink(missing_ok=True)
+        faiss_ids_path(path).unlink(missing_ok=True)
+        return None
+
+    factory = IVF_PQ_FACTORY if len(ids) >= MIN_IVF_TRAIN_ROWS else "IDMap,Flat"
+    index = faiss.index_factory(EMBEDDING_DIM, factory, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(matrix)
+    index.add_with_ids(matrix, ids)
+    # Unique temp name + replace: a reader never sees a half-written index
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix=".faiss")
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    os.replace(tmp, path)
+    # Written after the index, for the same reason as in save_bank()
+    _save_npy(faiss_ids_path(path), eids)
+    return _tune(index)
+
+
+def load_index(conn: sqlite3.Connection, path=FAISS_INDEX_PATH):
+    """
+    Read the sidecar index, (re)building it when it is missing or was built
+    from a different set of embedding rows than the table now holds.
+    """
+    if faiss is None:
+        return None
+    eids = embedding_ids(conn)
+    if Path(path).exists() and _ids_match(faiss_ids_path(path), eids):
+        index = faiss.read_index(str(path))
+        if index.ntotal == len(eids):
+            return _tune(index)
+    return build_index(conn, path)
+
+
+def is_exact(index) -> bool:
+    """True when the index is flat, so search() scores are exact inner products."""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return isinstance(index, faiss.IndexFlat)
+
+
+def search(index, query_embedding, k: int = 5):
+    """Return up to k (patient_id, approximate cosine) pairs, best first."""
+    q = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    q /= max(float(np.linalg.norm(q)), 1e-12)
+    scores, ids = index.search(q, k)
+    return [
+        (int(patient_id), float(score))
+        for patient_id, score in zip(ids[0], scores[0])
+        if patient_id != -1
+    ]
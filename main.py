@@ -1,29 +1,62 @@
+import asyncio
 import sqlite3
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional, List
-from datetime import datetime
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import shutil
-import json
 import numpy as np
 from fastapi import Query
 from fastapi.staticfiles import StaticFiles
 
+from cache import TTLCache
+import db
+from db import ConnectionPool, utc_now
+from embeddings import EMBEDDING_DIM, quantize_embedding
+import face_index
+
+try:
+    import simsimd
+except ImportError:  # optional; without it the float32 bank is scanned directly
+    simsimd = None
+
 
 DB_PATH = "clinic.db"
+FAISS_INDEX_PATH = face_index.faiss_index_path(DB_PATH)
 STATIC_DIR = Path("static")
 PHOTO_DIR = STATIC_DIR / "patient_photos"
 
 # Ensure folders exist
 PHOTO_DIR.mkdir(parents=True, exist_ok=True)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup steps in order (schema, WAL, face index, bank, pool); closes the DB on shutdown."""
+    global pool, _pool_slots
+    check_schema()
+    enable_wal()
+    load_face_index()
+    load_face_bank()
+    pool = ConnectionPool(DB_PATH)
+    _pool_slots = asyncio.Semaphore(pool.size)
+    try:
+        yield
+    finally:
+        pool.close()
+        db.close_conn()
+
+
 app = FastAPI(
     title="Clinic Medical Records API",
     description="FastAPI backend for patients, encounters, and face search (skeleton).",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
@@ -37,16 +70,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Recently read patients / summaries by patient_id. Routes that change an
+# existing patient row evict its id (the photo upload is the only one; the
+# summary view has no photo column, so SUMMARY_CACHE is unaffected)
+PATIENT_CACHE = TTLCache(maxsize=1024, ttl=30)
+SUMMARY_CACHE = TTLCache(maxsize=1024, ttl=30)
+
+# Optional FAISS index over patient_face_embeddings (None without faiss-cpu)
+FACE_INDEX = None
+
+# Every stored embedding as one unit-length float32 matrix, row i belonging
+# to patient EMB_IDS[i]; memory-mapped at startup by load_face_bank()
+EMB_IDS = np.empty(0, dtype=np.int64)
+EMB_MATRIX = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+# int8 copies of the same rows (only loaded with simsimd) and how many of
+# their nearest rows are re-scored exactly in float32
+EMB_I8 = np.empty((0, EMBEDDING_DIM), dtype=np.int8)
+INT8_SHORTLIST = 16
+
+# find_best_face_match scores the bank this many rows at a time; unit vectors
+# can't score above 1, so a tile reaching FACE_SCORE_CEILING ends the scan
+FACE_TILE_ROWS = 4096
+FACE_SCORE_CEILING = 1.0 - 1e-6
+
 
 # -------------------------------------------------------------------
 # DB helper
 # -------------------------------------------------------------------
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    # Enable foreign keys every time
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+# Connections are opened and configured once, by lifespan(), and reused
+# across requests
+pool = None
+# Requests queue for a connection here, on the event loop. Waiting inside a
+# sync dependency would park threadpool workers, and once they are all
+# parked the connection holders have no worker left to run their endpoint.
+# Created at startup, on the loop that serves the requests.
+_pool_slots = None
+
+
+async def get_db():
+    try:
+        await asyncio.wait_for(_pool_slots.acquire(), db.POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Database busy, retry shortly")
+    try:
+        conn = pool.get(timeout=0)  # holding a slot means one is idle
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
+    finally:
+        _pool_slots.release()
+
+
+def check_schema():
+    # The API reads the current schema (embedding BLOBs, summary cache) but
+    # never migrates; an older file has to go through create_db.py first
+    with db.lock:
+        user_version = db.get_conn().execute("PRAGMA user_version;").fetchone()[0]
+    if user_version != db.SCHEMA_VERSION:
+        raise RuntimeError(
+            f"{DB_PATH} is at schema version {user_version}, expected "
+            f"{db.SCHEMA_VERSION}; run create_db.py to migrate it"
+        )
+
+
+def enable_wal():
+    # No-op for databases made by create_db.py; covers ones that were not
+    with db.lock:
+        db.get_conn().execute("PRAGMA journal_mode = WAL;")
+
+
+def load_face_index():
+    global FACE_INDEX
+    with db.lock:
+        FACE_INDEX = face_index.load_index(db.get_conn(), FAISS_INDEX_PATH)
+
+
+def load_face_bank():
+    """(Re)load EMB_IDS / EMB_MATRIX; call again after embeddings are written."""
+    global EMB_IDS, EMB_MATRIX, EMB_I8
+    with db.lock:
+        conn = db.get_conn()
+        conn.execute("BEGIN;")  # one snapshot so both banks line up row for row
+        try:
+            EMB_IDS, EMB_MATRIX = face_index.load_bank(conn, DB_PATH)
+            if simsimd is not None:
+                EMB_I8 = face_index.load_int8_matrix(conn)
+        finally:
+            conn.commit()
+
+
+def _candidate_rows(q: np.ndarray):
+    """Row numbers of the bank worth scoring exactly, or None for all of them."""
+    if FACE_INDEX is not None:
+        candidate_ids = [pid for pid, _ in face_index.search(FACE_INDEX, q)]
+        return np.flatnonzero(np.isin(EMB_IDS, candidate_ids))
+    if simsimd is not None and len(EMB_I8) > INT8_SHORTLIST:
+        # Per-row scales cancel out of cosine, so the raw int8 codes compare directly
+        q_i8 = np.frombuffer(quantize_embedding(q)[0], dtype=np.int8)
+        distances = np.asarray(simsimd.cdist(q_i8[None, :], EMB_I8, metric="cosine"))[0]
+        return np.argpartition(distances, INT8_SHORTLIST)[:INT8_SHORTLIST]
+    return None
 
 
 # -------------------------------------------------------------------
@@ -170,6 +294,175 @@ class EncounterCreate(BaseModel):
     doctor_name: Optional[str] = None
 
 
+# Column lists for list endpoints, in model field order (see construct_rows)
+PATIENT_FIELDS = tuple(Patient.model_fields)
+ENCOUNTER_FIELDS = tuple(Encounter.model_fields)
+MEDICATION_FIELDS = tuple(MedicationOut.model_fields)
+ALLERGY_FIELDS = tuple(AllergyOut.model_fields)
+VITALS_FIELDS = tuple(VitalsOut.model_fields)
+LAB_RESULT_FIELDS = tuple(LabResultOut.model_fields)
+
+
+# -------------------------------------------------------------------
+# SQL
+# -------------------------------------------------------------------
+# Module-level statements: identical SQL text keeps hitting each pooled
+# connection's statement cache (db.STATEMENT_CACHE_SIZE) instead of re-parsing.
+SQL_SEARCH_PATIENTS = f"SELECT {', '.join(PATIENT_FIELDS)} FROM patients WHERE 1=1"
+
+SQL_INSERT_PATIENT = """
+    INSERT INTO patients (
+        first_name, last_name, date_of_birth, sex, phone_number, email, address, created_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_GET_PATIENT = f"""
+    SELECT {', '.join(PATIENT_FIELDS)} FROM patients
+    WHERE patient_id = ?
+"""
+
+SQL_GET_PATIENT_SUMMARY = """
+    SELECT
+        patient_id,
+        first_name,
+        last_name,
+        date_of_birth,
+        sex,
+        phone_number,
+        email,
+        address,
+        active_conditions,
+        active_medications,
+        active_allergies
+    FROM patient_summary
+    WHERE patient_id = ?
+"""
+
+SQL_LIST_PATIENTS = f"""
+    SELECT {', '.join(PATIENT_FIELDS)} FROM patients
+    ORDER BY patient_id LIMIT ? OFFSET ?
+"""
+
+SQL_PATIENT_EXISTS = "SELECT 1 FROM patients WHERE patient_id = ?"
+
+SQL_INSERT_ENCOUNTER = """
+    INSERT INTO encounters (
+        patient_id, encounter_date, encounter_type,
+        presenting_complaint, history_of_present_illness,
+        doctor_name, disposition, created_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_GET_ENCOUNTER = f"""
+    SELECT {', '.join(ENCOUNTER_FIELDS)} FROM encounters
+    WHERE encounter_id = ?
+"""
+
+SQL_LIST_PATIENT_ENCOUNTERS = f"""
+    SELECT {', '.join(ENCOUNTER_FIELDS)} FROM encounters
+    WHERE patient_id = ? ORDER BY encounter_date DESC
+"""
+
+SQL_INSERT_PATIENT_ENCOUNTER = """
+    INSERT INTO encounters (
+        patient_id,
+        encounter_date,
+        encounter_type,
+        presenting_complaint,
+        doctor_name,
+        created_at
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_GET_PATIENT_ENCOUNTER = """
+    SELECT encounter_id, patient_id, encounter_date,
+           encounter_type, presenting_complaint, doctor_name
+    FROM encounters WHERE encounter_id = ?
+"""
+
+SQL_LIST_PATIENT_MEDICATIONS = """
+    SELECT
+        medication_id,
+        drug_name,
+        dose,
+        route,
+        frequency,
+        start_date,
+        end_date,
+        is_active
+    FROM medications
+    WHERE patient_id = ?
+    ORDER BY is_active DESC, start_date DESC
+"""
+
+SQL_LIST_PATIENT_ALLERGIES = """
+    SELECT
+        allergy_id,
+        allergen,
+        reaction,
+        severity,
+        noted_date,
+        is_active
+    FROM allergies
+    WHERE patient_id = ?
+    ORDER BY is_active DESC, noted_date DESC
+"""
+
+SQL_LIST_ENCOUNTERS_FOR_VITALS_LABS = """
+    SELECT
+        encounter_id,
+        encounter_date,
+        encounter_type,
+        presenting_complaint
+    FROM encounters
+    WHERE patient_id = ?
+    ORDER BY encounter_date DESC
+"""
+
+SQL_LATEST_VITALS_BY_ENCOUNTER = """
+    SELECT
+        v.encounter_id,
+        v.recorded_at,
+        v.systolic_bp,
+        v.diastolic_bp,
+        v.heart_rate,
+        v.respiratory_rate,
+        v.temperature_c,
+        v.oxygen_saturation,
+        v.weight_kg,
+        v.height_cm
+    FROM vitals v
+    JOIN (
+        SELECT encounter_id, MAX(recorded_at) AS latest
+        FROM vitals
+        WHERE encounter_id IN (
+            SELECT encounter_id FROM encounters WHERE patient_id = ?
+        )
+        GROUP BY encounter_id
+    ) t ON v.encounter_id = t.encounter_id AND v.recorded_at = t.latest
+"""
+
+SQL_LAB_RESULTS_BY_PATIENT = """
+    SELECT
+        encounter_id,
+        lab_result_id,
+        test_name,
+        result_value,
+        units,
+        reference_range,
+        result_date
+    FROM lab_results
+    WHERE encounter_id IN (
+        SELECT encounter_id FROM encounters WHERE patient_id = ?
+    )
+    ORDER BY result_date DESC
+"""
+
+SQL_SET_PATIENT_PHOTO = "UPDATE patients SET photo_path = ? WHERE patient_id = ?"
+
+
 # -------------------------------------------------------------------
 # Utility: convert sqlite Row -> dict
 # -------------------------------------------------------------------
@@ -177,6 +470,39 @@ def row_to_dict(row: sqlite3.Row) -> dict:
     return {k: row[k] for k in row.keys()}
 
 
+def construct_rows(model, fields, rows) -> list:
+    """Build models from DB rows whose columns are in `fields` order.
+
+    model_construct skips validation and FastAPI serializes the result as-is,
+    so only use it for models whose field types match the stored columns
+    exactly; see validate_rows for the rest.
+    """
+    return [model.model_construct(**dict(zip(fields, r))) for r in rows]
+
+
+def validate_rows(model, fields, rows) -> list:
+    """Like construct_rows, but validated, so e.g. INTEGER 0/1 flags become bools."""
+    return [model.model_validate(dict(zip(fields, r))) for r in rows]
+
+
+def cached_fetch(cache: TTLCache, conn: sqlite3.Connection, sql: str, key: int):
+    """Row for `key` as a dict, from `cache` when fresh; None if there is no row."""
+    data = cache.get(key)
+    if data is None:
+        row = conn.execute(sql, (key,)).fetchone()
+        if row is None:
+            return None
+        data = row_to_dict(row)
+        cache.set(key, data)
+    return data
+
+
+def save_upload(file: UploadFile, file_path: Path):
+    """Copy an upload to disk; blocking, so async routes run it in the threadpool."""
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+
 # -------------------------------------------------------------------
 # Placeholder for face embedding extraction
 # -------------------------------------------------------------------
@@ -190,32 +516,52 @@ def extract_face_embedding(image_bytes: bytes) -> List[float]:
     raise NotImplementedError("Face embedding extraction not implemented yet.")
 
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    a_arr = np.array(a, dtype=float)
-    b_arr = np.array(b, dtype=float)
-    return float(np.dot(a_arr, b_arr) / (np.linalg.norm(a_arr) * np.linalg.norm(b_arr)))
+def _best_row(matrix: np.ndarray, q: np.ndarray):
+    """(row, score) of the largest matrix @ q, scanned tile by tile."""
+    best_row, best_score = -1, -np.inf
+    for start in range(0, len(matrix), FACE_TILE_ROWS):
+        scores = matrix[start:start + FACE_TILE_ROWS] @ q
+        i = int(scores.argmax())
+        if scores[i] > best_score:
+            best_row, best_score = start + i, float(scores[i])
+            if best_score >= FACE_SCORE_CEILING:
+                break
+    return best_row, best_score
 
 
 def find_best_face_match(query_embedding: List[float], min_similarity: float = 0.85):
     """
-    Load all embeddings from the DB and return best (patient_id, score) if above threshold.
-    Otherwise return (None, best_score).
+    Score the query against every cached embedding and return best (patient_id, score)
+    if above threshold. Otherwise return (None, best_score).
+
+    Stored rows are unit-length, so cosine similarity is a matrix-vector
+    product, taken in FACE_TILE_ROWS tiles. An exact (flat) FAISS index
+    answers directly; an approximate one, or simsimd, only picks a shortlist
+    of candidates to score exactly.
     """
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT patient_id, embedding_json FROM patient_face_embeddings")
-    rows = cur.fetchall()
-    conn.close()
+    q = np.asarray(query_embedding, dtype=np.float32)
+    q = q / max(float(np.linalg.norm(q)), 1e-12)
+
+    if FACE_INDEX is not None and face_index.is_exact(FACE_INDEX):
+        # Flat inner-product index: its top hit already is the exact answer
+        hits = face_index.search(FACE_INDEX, q, k=1)
+        if not hits:
+            return None, -1.0
+        best_patient_id, best_score = hits[0]
+        if best_score >= min_similarity:
+            return best_patient_id, best_score
+        return None, best_score
 
-    best_patient_id = None
-    best_score = -1.0
+    ids, matrix = EMB_IDS, EMB_MATRIX
+    rows = _candidate_rows(q)
+    if rows is not None:
+        ids, matrix = ids[rows], matrix[rows]
 
-    for row in rows:
-        emb = json.loads(row["embedding_json"])
-        score = cosine_similarity(query_embedding, emb)
-        if score > best_score:
-            best_score = score
-            best_patient_id = row["patient_id"]
+    if len(ids) == 0:
+        return None, -1.0
+
+    i, best_score = _best_row(matrix, q)
+    best_patient_id = int(ids[i])
 
     if best_score >= min_similarity:
         return best_patient_id, best_score
@@ -231,6 +577,11 @@ def root():
     return {"message": "Clinic API is running"}
 
 
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok", "pool": pool.stats()}
+
+
 # ---------------- Patients ----------------
 
 @app.get("/patients/search", response_model=List[Patient])
@@ -245,15 +596,15 @@ def search_patients(
     ),
     limit: int = 20,
     offset: int = 0,
+    conn: sqlite3.Connection = Depends(get_db),
 ):
     """
     Search patients by partial name and/or exact date of birth.
     This will be the main search endpoint your frontend uses.
     """
-    conn = get_db()
     cur = conn.cursor()
 
-    sql = "SELECT * FROM patients WHERE 1=1"
+    sql = SQL_SEARCH_PATIENTS
     params = []
 
     if name:
@@ -270,19 +621,14 @@ def search_patients(
 
     cur.execute(sql, params)
     rows = cur.fetchall()
-    conn.close()
 
-    return [Patient(**row_to_dict(r)) for r in rows]
+    return construct_rows(Patient, PATIENT_FIELDS, rows)
 
 @app.post("/patients", response_model=Patient)
-def create_patient(patient: PatientCreate):
-    conn = get_db()
+def create_patient(patient: PatientCreate, conn: sqlite3.Connection = Depends(get_db)):
     cur = conn.cursor()
     cur.execute(
-        """
-        INSERT INTO patients (first_name, last_name, date_of_birth, sex, phone_number, email, address)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
+        SQL_INSERT_PATIENT,
         (
             patient.first_name,
             patient.last_name,
@@ -291,47 +637,35 @@ def create_patient(patient: PatientCreate):
             patient.phone_number,
             patient.email,
             patient.address,
+            utc_now(),
         ),
     )
     conn.commit()
     patient_id = cur.lastrowid
 
-    cur.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,))
+    cur.execute(SQL_GET_PATIENT, (patient_id,))
     row = cur.fetchone()
-    conn.close()
 
     return Patient(**row_to_dict(row))
 
 
 @app.get("/patients/{patient_id}", response_model=Patient)
-def get_patient(patient_id: int):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,))
-    row = cur.fetchone()
-    conn.close()
+def get_patient(patient_id: int, conn: sqlite3.Connection = Depends(get_db)):
+    data = cached_fetch(PATIENT_CACHE, conn, SQL_GET_PATIENT, patient_id)
 
-    if row is None:
+    if data is None:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    return Patient(**row_to_dict(row))
+    return Patient.model_construct(**data)
 
 
 @app.get("/patients/{patient_id}/summary", response_model=PatientSummary)
-def get_patient_summary(patient_id: int):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT * FROM patient_summary WHERE patient_id = ?",
-        (patient_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+def get_patient_summary(patient_id: int, conn: sqlite3.Connection = Depends(get_db)):
+    data = cached_fetch(SUMMARY_CACHE, conn, SQL_GET_PATIENT_SUMMARY, patient_id)
 
-    if row is None:
+    if data is None:
         raise HTTPException(status_code=404, detail="Patient summary not found")
 
-    data = row_to_dict(row)
     # Rename keys from snake_case in view to Pydantic model fields:
     return PatientSummary(
         patient_id=data["patient_id"],
@@ -350,38 +684,26 @@ def get_patient_summary(patient_id: int):
 
 
 @app.get("/patients", response_model=List[Patient])
-def list_patients(limit: int = 50, offset: int = 0):
-    conn = get_db()
+def list_patients(
+    limit: int = 50, offset: int = 0, conn: sqlite3.Connection = Depends(get_db)
+):
     cur = conn.cursor()
-    cur.execute(
-        "SELECT * FROM patients ORDER BY patient_id LIMIT ? OFFSET ?",
-        (limit, offset),
-    )
+    cur.execute(SQL_LIST_PATIENTS, (limit, offset))
     rows = cur.fetchall()
-    conn.close()
-    return [Patient(**row_to_dict(r)) for r in rows]
+    return construct_rows(Patient, PATIENT_FIELDS, rows)
 
 
 # ---------------- Encounters ----------------
 @app.post("/encounters", response_model=Encounter)
-def create_encounter(enc: EncounterCreate):
+def create_encounter(enc: EncounterCreate, conn: sqlite3.Connection = Depends(get_db)):
     # Check patient exists
-    conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT 1 FROM patients WHERE patient_id = ?", (enc.patient_id,))
+    cur.execute(SQL_PATIENT_EXISTS, (enc.patient_id,))
     if cur.fetchone() is None:
-        conn.close()
         raise HTTPException(status_code=404, detail="Patient not found")
 
     cur.execute(
-        """
-        INSERT INTO encounters (
-            patient_id, encounter_date, encounter_type,
-            presenting_complaint, history_of_present_illness,
-            doctor_name, disposition
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
+        SQL_INSERT_ENCOUNTER,
         (
             enc.patient_id,
             enc.encounter_date,
@@ -390,25 +712,23 @@ def create_encounter(enc: EncounterCreate):
             enc.history_of_present_illness,
             enc.doctor_name,
             enc.disposition,
+            utc_now(),
         ),
     )
     conn.commit()
     encounter_id = cur.lastrowid
 
-    cur.execute("SELECT * FROM encounters WHERE encounter_id = ?", (encounter_id,))
+    cur.execute(SQL_GET_ENCOUNTER, (encounter_id,))
     row = cur.fetchone()
-    conn.close()
 
     return Encounter(**row_to_dict(row))
 
 
 @app.get("/encounters/{encounter_id}", response_model=Encounter)
-def get_encounter(encounter_id: int):
-    conn = get_db()
+def get_encounter(encounter_id: int, conn: sqlite3.Connection = Depends(get_db)):
     cur = conn.cursor()
-    cur.execute("SELECT * FROM encounters WHERE encounter_id = ?", (encounter_id,))
+    cur.execute(SQL_GET_ENCOUNTER, (encounter_id,))
     row = cur.fetchone()
-    conn.close()
 
     if row is None:
         raise HTTPException(status_code=404, detail="Encounter not found")
@@ -417,250 +737,174 @@ def get_encounter(encounter_id: int):
 
 
 @app.get("/patients/{patient_id}/encounters", response_model=List[Encounter])
-def list_patient_encounters(patient_id: int):
-    conn = get_db()
+def list_patient_encounters(
+    patient_id: int, conn: sqlite3.Connection = Depends(get_db)
+):
     cur = conn.cursor()
-    cur.execute(
-        "SELECT * FROM encounters WHERE patient_id = ? ORDER BY encounter_date DESC",
-        (patient_id,),
-    )
+    cur.execute(SQL_LIST_PATIENT_ENCOUNTERS, (patient_id,))
     rows = cur.fetchall()
-    conn.close()
-    return [Encounter(**row_to_dict(r)) for r in rows]
+    return construct_rows(Encounter, ENCOUNTER_FIELDS, rows)
 
 
 @app.post("/patients/{patient_id}/encounters", response_model=Encounter)
-def create_patient_encounter(patient_id: int, payload: EncounterCreate):
-    conn = get_db()
+def create_patient_encounter(
+    patient_id: int, payload: EncounterCreate, conn: sqlite3.Connection = Depends(get_db)
+):
     cur = conn.cursor()
 
     # Check patient exists
-    cur.execute("SELECT 1 FROM patients WHERE patient_id = ?", (patient_id,))
+    cur.execute(SQL_PATIENT_EXISTS, (patient_id,))
     if cur.fetchone() is None:
-        conn.close()
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    # timestamp
-    encounter_date = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    # timestamp ('YYYY-MM-DD HH:MM:SS' UTC), also used as created_at
+    encounter_date = utc_now()
 
     # Insert
     cur.execute(
-        """
-        INSERT INTO encounters (
-            patient_id,
-            encounter_date,
-            encounter_type,
-            presenting_complaint,
-            doctor_name
-        ) VALUES (?, ?, ?, ?, ?)
-        """,
+        SQL_INSERT_PATIENT_ENCOUNTER,
         (
             patient_id,
             encounter_date,
             payload.encounter_type,
             payload.presenting_complaint,
             payload.doctor_name,
+            encounter_date,
         ),
     )
     conn.commit()
 
     new_id = cur.lastrowid
 
-    cur.execute(
-        """
-        SELECT encounter_id, patient_id, encounter_date,
-               encounter_type, presenting_complaint, doctor_name
-        FROM encounters WHERE encounter_id = ?
-        """,
-        (new_id,),
-    )
+    cur.execute(SQL_GET_PATIENT_ENCOUNTER, (new_id,))
     row = cur.fetchone()
-    conn.close()
 
     return Encounter(**row_to_dict(row))
 
 
 @app.get("/patients/{patient_id}/medications", response_model=List[MedicationOut])
-def list_patient_medications(patient_id: int):
-    conn = get_db()
+def list_patient_medications(
+    patient_id: int, conn: sqlite3.Connection = Depends(get_db)
+):
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            medication_id,
-            drug_name,
-            dose,
-            route,
-            frequency,
-            start_date,
-            end_date,
-            is_active
-        FROM medications
-        WHERE patient_id = ?
-        ORDER BY is_active DESC, start_date DESC
-        """,
-        (patient_id,),
-    )
+    cur.execute(SQL_LIST_PATIENT_MEDICATIONS, (patient_id,))
     rows = cur.fetchall()
-    conn.close()
-    return [MedicationOut(**row_to_dict(r)) for r in rows]
+    return validate_rows(MedicationOut, MEDICATION_FIELDS, rows)
 
 
 @app.get("/patients/{patient_id}/allergies", response_model=List[AllergyOut])
-def list_patient_allergies(patient_id: int):
-    conn = get_db()
+def list_patient_allergies(patient_id: int, conn: sqlite3.Connection = Depends(get_db)):
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            allergy_id,
-            allergen,
-            reaction,
-            severity,
-            noted_date,
-            is_active
-        FROM allergies
-        WHERE patient_id = ?
-        ORDER BY is_active DESC, noted_date DESC
-        """,
-        (patient_id,),
-    )
+    cur.execute(SQL_LIST_PATIENT_ALLERGIES, (patient_id,))
     rows = cur.fetchall()
-    conn.close()
-    return [AllergyOut(**row_to_dict(r)) for r in rows]
+    return validate_rows(AllergyOut, ALLERGY_FIELDS, rows)
 
 
 @app.get(
     "/patients/{patient_id}/vitals-labs",
     response_model=List[EncounterVitalsLabs],
 )
-def list_patient_vitals_labs(patient_id: int):
+def list_patient_vitals_labs(
+    patient_id: int, conn: sqlite3.Connection = Depends(get_db)
+):
     """
     For each encounter, return latest vitals (if any) and all lab results.
     """
-    conn = get_db()
     cur = conn.cursor()
 
     # get encounters for this patient
-    cur.execute(
-        """
-        SELECT
-            encounter_id,
-            encounter_date,
-            encounter_type,
-            presenting_complaint
-        FROM encounters
-        WHERE patient_id = ?
-        ORDER BY encounter_date DESC
-        """,
-        (patient_id,),
-    )
+    cur.execute(SQL_LIST_ENCOUNTERS_FOR_VITALS_LABS, (patient_id,))
     encounters = cur.fetchall()
 
-    results: List[EncounterVitalsLabs] = []
+    # latest vitals per encounter, all in one query (ties on recorded_at
+    # keep the first row returned)
+    cur.execute(SQL_LATEST_VITALS_BY_ENCOUNTER, (patient_id,))
+    vitals_by_encounter = {}
+    for enc_id, *values in cur.fetchall():
+        if enc_id not in vitals_by_encounter:
+            vitals_by_encounter[enc_id] = VitalsOut.model_construct(
+                **dict(zip(VITALS_FIELDS, values))
+            )
 
-    for enc in encounters:
-        enc_dict = row_to_dict(enc)
-        enc_id = enc_dict["encounter_id"]
-
-        # latest vitals for this encounter
-        cur.execute(
-            """
-            SELECT
-                recorded_at,
-                systolic_bp,
-                diastolic_bp,
-                heart_rate,
-                respiratory_rate,
-                temperature_c,
-                oxygen_saturation,
-                weight_kg,
-                height_cm
-            FROM vitals
-            WHERE encounter_id = ?
-            ORDER BY recorded_at DESC
-            LIMIT 1
-            """,
-            (enc_id,),
-        )
-        v_row = cur.fetchone()
-        vitals = VitalsOut(**row_to_dict(v_row)) if v_row else None
-
-        # all lab results for this encounter
-        cur.execute(
-            """
-            SELECT
-                lab_result_id,
-                test_name,
-                result_value,
-                units,
-                reference_range,
-                result_date
-            FROM lab_results
-            WHERE encounter_id = ?
-            ORDER BY result_date DESC
-            """,
-            (enc_id,),
+    # all lab results for the patient's encounters
+    cur.execute(SQL_LAB_RESULTS_BY_PATIENT, (patient_id,))
+    labs_by_encounter = defaultdict(list)
+    for enc_id, *values in cur.fetchall():
+        labs_by_encounter[enc_id].append(
+            LabResultOut.model_construct(**dict(zip(LAB_RESULT_FIELDS, values)))
         )
-        lab_rows = cur.fetchall()
-        labs = [LabResultOut(**row_to_dict(r)) for r in lab_rows]
 
+    results: List[EncounterVitalsLabs] = []
+
+    for enc_id, encounter_date, encounter_type, presenting_complaint in encounters:
         results.append(
-            EncounterVitalsLabs(
+            EncounterVitalsLabs.model_construct(
                 encounter_id=enc_id,
-                encounter_date=enc_dict["encounter_date"],
-                encounter_type=enc_dict.get("encounter_type"),
-                presenting_complaint=enc_dict.get("presenting_complaint"),
-                vitals=vitals,
-                lab_results=labs,
+                encounter_date=encounter_date,
+                encounter_type=encounter_type,
+                presenting_complaint=presenting_complaint,
+                vitals=vitals_by_encounter.get(enc_id),
+                lab_results=labs_by_encounter[enc_id],
             )
         )
 
-    conn.close()
     return results
 
 # ---------------- Photo upload + face embedding skeleton ----------------
-@app.post("/patients/{patient_id}/photo", response_model=Patient)
-async def upload_patient_photo(patient_id: int, file: UploadFile = File(...)):
-    conn = get_db()
-    cur = conn.cursor()
+# The routes below are async (they await the upload); their blocking SQLite
+# and numpy work goes through run_in_threadpool so the event loop stays free.
+def _patient_exists(conn: sqlite3.Connection, patient_id: int) -> bool:
+    cur = conn.execute(SQL_PATIENT_EXISTS, (patient_id,))
+    return cur.fetchone() is not None
+
 
+def _set_patient_photo(conn: sqlite3.Connection, patient_id: int, photo_path: str):
+    conn.execute(SQL_SET_PATIENT_PHOTO, (photo_path, patient_id))
+    conn.commit()
+    PATIENT_CACHE.pop(patient_id)
+    cur = conn.execute(SQL_GET_PATIENT, (patient_id,))
+    return cur.fetchone()
+
+
+def _fetch_patient_summary(conn: sqlite3.Connection, patient_id: int):
+    cur = conn.execute(SQL_GET_PATIENT_SUMMARY, (patient_id,))
+    return cur.fetchone()
+
+
+@app.post("/patients/{patient_id}/photo", response_model=Patient)
+async def upload_patient_photo(
+    patient_id: int,
+    file: UploadFile = File(...),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     # Check patient exists
-    cur.execute("SELECT 1 FROM patients WHERE patient_id = ?", (patient_id,))
-    if cur.fetchone() is None:
-        conn.close()
+    if not await run_in_threadpool(_patient_exists, conn, patient_id):
         raise HTTPException(status_code=404, detail="Patient not found")
 
     # Save file to static/patient_photos
     filename = f"patient_{patient_id}_{file.filename}"
     file_path = PHOTO_DIR / filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await run_in_threadpool(save_upload, file, file_path)
 
     # Store URL-style relative path (with forward slashes)
     photo_path = f"static/patient_photos/{filename}"
 
-    cur.execute(
-        "UPDATE patients SET photo_path = ? WHERE patient_id = ?",
-        (photo_path, patient_id),
-    )
-    conn.commit()
-
     # Return updated patient
-    cur.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,))
-    row = cur.fetchone()
-    conn.close()
+    row = await run_in_threadpool(_set_patient_photo, conn, patient_id, photo_path)
     return Patient(**row_to_dict(row))
 
 
 
 @app.post("/patients/search/face", response_model=FaceSearchResult)
-async def search_patient_by_face(file: UploadFile = File(...)):
+async def search_patient_by_face(
+    file: UploadFile = File(...),
+    conn: sqlite3.Connection = Depends(get_db),
+):
     image_bytes = await file.read()
 
     # Extract embedding (NOT IMPLEMENTED YET)
     try:
-        query_embedding = extract_face_embedding(image_bytes)
+        query_embedding = await run_in_threadpool(extract_face_embedding, image_bytes)
     except NotImplementedError as e:
         # For now, clearly signal that the model isn't implemented
         raise HTTPException(status_code=501, detail=str(e))
@@ -668,20 +912,15 @@ async def search_patient_by_face(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Could not process face image")
 
     # Find best match
-    patient_id, score = find_best_face_match(query_embedding, min_similarity=0.85)
+    patient_id, score = await run_in_threadpool(
+        find_best_face_match, query_embedding, min_similarity=0.85
+    )
 
     if patient_id is None:
         return FaceSearchResult(match_found=False, confidence=score, patient=None)
 
     # Fetch summary for matched patient
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT * FROM patient_summary WHERE patient_id = ?",
-        (patient_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    row = await run_in_threadpool(_fetch_patient_summary, conn, patient_id)
 
     if row is None:
         # Should not normally happen if DB is consistent
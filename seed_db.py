@@ -1,10 +1,25 @@
 import sqlite3
-import random
+import multiprocessing
 from datetime import datetime, timedelta
 from pathlib import Path
 
+import numpy as np
+
+from create_db import drop_indexes, finalize_indexes
+from db import configure_connection, utc_now
+
 DB_PATH = "clinic.db"
 
+# Encounter generation is split into chunks of this many patients; with more
+# than one chunk they are generated in a process pool of GENERATOR_WORKERS
+GENERATOR_CHUNK_PATIENTS = 2000
+GENERATOR_WORKERS = 4
+
+# Every random draw comes from this generator, as vectors; set SEED to an
+# int to make a run reproducible
+SEED = None
+rng = np.random.default_rng(SEED)
+
 FIRST_NAMES = [
     "John", "Jane", "Michael", "Sarah", "David", "Emily", "James", "Olivia",
     "Daniel", "Sophia", "Matthew", "Amina", "Ibrahim", "Fatima", "Oluwadamilola",
@@ -29,14 +44,15 @@ CONDITIONS = [
     ("Epilepsy", "G40"),
 ]
 
+# (drug_name, dose)
 MEDICATIONS = [
-    "Metformin 500 mg",
-    "Lisinopril 10 mg",
-    "Amlodipine 5 mg",
-    "Salbutamol Inhaler",
-    "Sertraline 50 mg",
-    "Atorvastatin 20 mg",
-    "Omeprazole 20 mg",
+    ("Metformin", "500 mg"),
+    ("Lisinopril", "10 mg"),
+    ("Amlodipine", "5 mg"),
+    ("Salbutamol Inhaler", None),
+    ("Sertraline", "50 mg"),
+    ("Atorvastatin", "20 mg"),
+    ("Omeprazole", "20 mg"),
 ]
 
 ALLERGENS = [
@@ -59,6 +75,15 @@ LAB_TESTS = [
     ("Platelets", "x10^9/L", "150-400"),
 ]
 
+# Range sampled for each lab test's result value
+LAB_VALUE_RANGES = {
+    "HbA1c": (30, 90),
+    "Creatinine": (50, 400),
+    "Hemoglobin": (8, 18),
+    "WBC": (2, 20),
+    "Platelets": (50, 600),
+}
+
 OCCUPATIONS = [
     "Teacher", "Engineer", "Trader", "Student", "Farmer",
     "Software Developer", "Nurse", "Driver", "Accountant", "Chef"
@@ -69,256 +94,347 @@ LIVING_SITUATIONS = [
 ]
 
 
-def random_date(start_year=1940, end_year=2015):
-    """Return a random date between start_year-01-01 and end_year-12-31."""
-    start = datetime(start_year, 1, 1)
-    end = datetime(end_year, 12, 31)
-    delta = end - start
-    random_days = random.randint(0, delta.days)
-    return (start + timedelta(days=random_days)).strftime("%Y-%m-%d")
-
-
-def random_datetime_in_last_year():
-    now = datetime.now()
-    start = now - timedelta(days=365)
-    random_seconds = random.randint(0, int((now - start).total_seconds()))
-    dt = start + timedelta(seconds=random_seconds)
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
+# Insert statements, one constant per table so every executemany()/execute()
+# reuses the same cached prepared statement
+INSERT_PATIENT_SQL = """
+    INSERT INTO patients (
+        first_name, last_name, date_of_birth, sex, phone_number, email, address, created_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Plain INSERT: seed_patients() always hands out fresh patient ids, so the
+# UNIQUE(patient_id) conflict OR REPLACE guarded against cannot happen
+INSERT_SOCIAL_HISTORY_SQL = """
+    INSERT INTO social_history (
+        patient_id, smoking_status, pack_years,
+        alcohol_use, drug_use, occupation, living_situation, last_updated
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_CONDITION_SQL = """
+    INSERT INTO medical_conditions (patient_id, name, code_system, code, onset_date, is_active)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_MEDICATION_SQL = """
+    INSERT INTO medications (
+        patient_id, drug_name, dose, route, frequency,
+        start_date, end_date, is_active
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_ALLERGY_SQL = """
+    INSERT INTO allergies (
+        patient_id, allergen, reaction, severity, noted_date, is_active
+    )
+    VALUES (?, ?, ?, ?, ?, 1)
+"""
+
+INSERT_IMMUNIZATION_SQL = """
+    INSERT INTO immunizations (
+        patient_id, vaccine_name, dose_number, vaccination_date, lot_number
+    )
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+INSERT_ENCOUNTER_SQL = """
+    INSERT INTO encounters (
+        patient_id, encounter_date, encounter_type,
+        presenting_complaint, history_of_present_illness,
+        doctor_name, disposition, created_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_VITALS_SQL = """
+    INSERT INTO vitals (
+        encounter_id, recorded_at, systolic_bp, diastolic_bp,
+        heart_rate, respiratory_rate, temperature_c,
+        oxygen_saturation, weight_kg, height_cm
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_LAB_RESULT_SQL = """
+    INSERT INTO lab_results (
+        encounter_id, test_name, result_value,
+        units, reference_range, result_date
+    )
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def random_dates(n, start_year=1940, end_year=2015):
+    """Return n random 'YYYY-MM-DD' dates between start_year-01-01 and end_year-12-31."""
+    start = np.datetime64(f"{start_year}-01-01")
+    days = (np.datetime64(f"{end_year}-12-31") - start).astype(int)
+    dates = start + rng.integers(0, days + 1, n).astype("timedelta64[D]")
+    return dates.astype("U10").tolist()
+
+
+def random_datetimes_in_last_year(n):
+    """Return n random local 'YYYY-MM-DD HH:MM:SS' timestamps from the past year."""
+    now = np.datetime64(datetime.now(), "s")
+    seconds = int(timedelta(days=365).total_seconds())
+    stamps = now - rng.integers(0, seconds + 1, n).astype("timedelta64[s]")
+    return np.char.replace(stamps.astype("U19"), "T", " ").tolist()
+
+
+def pick(options, n):
+    """n uniform picks from options, drawn as one vector of indices."""
+    return [options[i] for i in rng.integers(0, len(options), n).tolist()]
+
+
+def expand_ids(ids, counts):
+    """Repeat ids[i] counts[i] times: the parent id (or value) of every child row."""
+    return [pid for pid, n in zip(ids, counts) for _ in range(n)]
+
+
+def inserted_ids(cur, n):
+    """
+    Ids of the n rows the last executemany() on cur inserted. main() holds the
+    write lock for the whole seed, so AUTOINCREMENT hands them out
+    consecutively, ending at last_insert_rowid() (cursor.lastrowid is None
+    after executemany()).
+    """
+    last_id = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return range(last_id - n + 1, last_id + 1)
 
 
 def seed_patients(conn, num_patients=79):
     cur = conn.cursor()
-    patients_ids = []
-
-    for _ in range(num_patients):
-        first_name = random.choice(FIRST_NAMES)
-        last_name = random.choice(LAST_NAMES)
-        dob = random_date(1940, 2015)
-        sex = random.choice(SEXES)
-        phone = f"+44 7{random.randint(100000000, 999999999)}"
-        email = f"{first_name.lower()}.{last_name.lower()}{random.randint(1, 999)}@example.com"
-        address = f"{random.randint(1, 200)} Example Street, City"
-
-        cur.execute(
-            """
-            INSERT INTO patients (first_name, last_name, date_of_birth, sex, phone_number, email, address)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (first_name, last_name, dob, sex, phone, email, address),
+    created_at = utc_now()
+
+    first_names = pick(FIRST_NAMES, num_patients)
+    last_names = pick(LAST_NAMES, num_patients)
+    sexes = pick(SEXES, num_patients)
+
+    dobs = random_dates(num_patients, 1940, 2015)
+
+    phones = [f"+44 7{p}" for p in rng.integers(100000000, 1000000000, num_patients).tolist()]
+    emails = [
+        f"{first_name.lower()}.{last_name.lower()}{k}@example.com"
+        for first_name, last_name, k in zip(
+            first_names, last_names, rng.integers(1, 1000, num_patients).tolist()
         )
-        patients_ids.append(cur.lastrowid)
+    ]
+    addresses = [f"{k} Example Street, City" for k in rng.integers(1, 201, num_patients).tolist()]
 
-    conn.commit()
-    return patients_ids
+    rows = list(zip(
+        first_names, last_names, dobs, sexes, phones, emails, addresses,
+        [created_at] * num_patients,
+    ))
+
+    cur.executemany(INSERT_PATIENT_SQL, rows)
+    return list(inserted_ids(cur, len(rows)))
 
 
 def seed_social_history(conn, patient_ids):
     cur = conn.cursor()
-    for pid in patient_ids:
-        smoking_status = random.choice(["Never", "Former", "Current"])
-        pack_years = round(random.uniform(0, 40), 1) if smoking_status != "Never" else 0.0
-        alcohol_use = f"{random.randint(0, 30)} units/week"
-        drug_use = random.choice(["None", "Occasional", "Regular"])
-        occupation = random.choice(OCCUPATIONS)
-        living = random.choice(LIVING_SITUATIONS)
-
-        cur.execute(
-            """
-            INSERT OR REPLACE INTO social_history (
-                patient_id, smoking_status, pack_years,
-                alcohol_use, drug_use, occupation, living_situation
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (pid, smoking_status, pack_years, alcohol_use, drug_use, occupation, living),
-        )
-    conn.commit()
+    last_updated = utc_now()
+    n = len(patient_ids)
+
+    smoking_statuses = pick(["Never", "Former", "Current"], n)
+    drug_uses = pick(["None", "Occasional", "Regular"], n)
+    occupations = pick(OCCUPATIONS, n)
+    livings = pick(LIVING_SITUATIONS, n)
+
+    never = np.array(smoking_statuses) == "Never"
+    pack_years = np.where(never, 0.0, np.round(rng.uniform(0, 40, n), 1)).tolist()
+    alcohol_uses = [f"{units} units/week" for units in rng.integers(0, 31, n).tolist()]
+
+    rows = list(zip(
+        patient_ids, smoking_statuses, pack_years, alcohol_uses,
+        drug_uses, occupations, livings, [last_updated] * n,
+    ))
+
+    cur.executemany(INSERT_SOCIAL_HISTORY_SQL, rows)
 
 
 def seed_conditions(conn, patient_ids):
     cur = conn.cursor()
-    for pid in patient_ids:
-        num_conditions = random.randint(0, 3)
-        for _ in range(num_conditions):
-            name, code = random.choice(CONDITIONS)
-            onset = random_date(1990, 2023)
-            is_active = random.choice([0, 1, 1])  # bias slightly towards active
-            cur.execute(
-                """
-                INSERT INTO medical_conditions (patient_id, name, code_system, code, onset_date, is_active)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (pid, name, "ICD10", code, onset, is_active),
-            )
-    conn.commit()
+    pids = expand_ids(patient_ids, rng.integers(0, 4, len(patient_ids)).tolist())
+    conditions = pick(CONDITIONS, len(pids))
+    actives = pick([0, 1, 1], len(pids))  # bias slightly towards active
+
+    onsets = random_dates(len(pids), 1990, 2023)
+
+    rows = [
+        (pid, name, "ICD10", code, onset, is_active)
+        for pid, (name, code), is_active, onset in zip(pids, conditions, actives, onsets)
+    ]
+
+    cur.executemany(INSERT_CONDITION_SQL, rows)
 
 
 def seed_medications(conn, patient_ids):
     cur = conn.cursor()
-    for pid in patient_ids:
-        num_meds = random.randint(0, 4)
-        for _ in range(num_meds):
-            med = random.choice(MEDICATIONS)
-            parts = med.split()
-            drug_name = " ".join(parts[:-2]) if len(parts) > 2 else med
-            dose = " ".join(parts[-2:]) if len(parts) > 2 else None
-
-            start_date = random_date(2015, 2024)
-            is_active = random.choice([0, 1, 1])  # more likely active
-            end_date = None
-            if not is_active:
-                # some time after start date
-                end_date = random_date(2016, 2024)
-
-            cur.execute(
-                """
-                INSERT INTO medications (
-                    patient_id, drug_name, dose, route, frequency,
-                    start_date, end_date, is_active
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    pid,
-                    drug_name,
-                    dose,
-                    "oral",
-                    random.choice(["once daily", "bd", "tid"]),
-                    start_date,
-                    end_date,
-                    is_active,
-                ),
-            )
-    conn.commit()
+    pids = expand_ids(patient_ids, rng.integers(0, 5, len(patient_ids)).tolist())
+    meds = pick(MEDICATIONS, len(pids))
+    actives = pick([0, 1, 1], len(pids))  # more likely active
+    frequencies = pick(["once daily", "bd", "tid"], len(pids))
+    start_dates = random_dates(len(pids), 2015, 2024)
+    end_dates = random_dates(len(pids), 2016, 2024)
+
+    rows = []
+    for pid, (drug_name, dose), is_active, frequency, start_date, stop_date in zip(
+        pids, meds, actives, frequencies, start_dates, end_dates
+    ):
+        end_date = None
+        if not is_active:
+            # some time after start date
+            end_date = stop_date
+
+        rows.append((
+            pid,
+            drug_name,
+            dose,
+            "oral",
+            frequency,
+            start_date,
+            end_date,
+            is_active,
+        ))
+
+    cur.executemany(INSERT_MEDICATION_SQL, rows)
 
 
 def seed_allergies(conn, patient_ids):
     cur = conn.cursor()
-    for pid in patient_ids:
-        num_allergies = random.randint(0, 2)
-        for _ in range(num_allergies):
-            allergen, reaction = random.choice(ALLERGENS)
-            severity = random.choice(["Mild", "Moderate", "Severe"])
-            noted_date = random_date(2000, 2024)
-            cur.execute(
-                """
-                INSERT INTO allergies (
-                    patient_id, allergen, reaction, severity, noted_date, is_active
-                )
-                VALUES (?, ?, ?, ?, ?, 1)
-                """,
-                (pid, allergen, reaction, severity, noted_date),
-            )
-    conn.commit()
+    pids = expand_ids(patient_ids, rng.integers(0, 3, len(patient_ids)).tolist())
+    allergens = pick(ALLERGENS, len(pids))
+    severities = pick(["Mild", "Moderate", "Severe"], len(pids))
+
+    noted_dates = random_dates(len(pids), 2000, 2024)
+
+    rows = [
+        (pid, allergen, reaction, severity, noted_date)
+        for pid, (allergen, reaction), severity, noted_date in zip(
+            pids, allergens, severities, noted_dates
+        )
+    ]
+
+    cur.executemany(INSERT_ALLERGY_SQL, rows)
 
 
 def seed_immunizations(conn, patient_ids):
     cur = conn.cursor()
-    for pid in patient_ids:
-        num_vaccines = random.randint(0, 3)
-        for _ in range(num_vaccines):
-            vaccine = random.choice(VACCINES)
-            dose_number = random.randint(1, 3)
-            vaccination_date = random_date(2000, 2024)
-            lot_number = f"LOT{random.randint(10000, 99999)}"
-            cur.execute(
-                """
-                INSERT INTO immunizations (
-                    patient_id, vaccine_name, dose_number, vaccination_date, lot_number
-                )
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (pid, vaccine, dose_number, vaccination_date, lot_number),
-            )
-    conn.commit()
+    pids = expand_ids(patient_ids, rng.integers(0, 4, len(patient_ids)).tolist())
+    vaccines = pick(VACCINES, len(pids))
+    vaccination_dates = random_dates(len(pids), 2000, 2024)
+
+    dose_numbers = rng.integers(1, 4, len(pids)).tolist()
+    lot_numbers = [f"LOT{lot}" for lot in rng.integers(10000, 100000, len(pids)).tolist()]
+
+    rows = list(zip(pids, vaccines, dose_numbers, vaccination_dates, lot_numbers))
+
+    cur.executemany(INSERT_IMMUNIZATION_SQL, rows)
+
+
+def generate_encounters_chunk(args):
+    """
+    Build the encounter, vitals and lab rows for a chunk of patients, without
+    touching the database. Vitals and lab rows carry the position of their
+    encounter in encounter_rows instead of an encounter_id. A pool worker
+    gets its own `seed` for the chunk; in-process calls pass None and keep
+    drawing from the module rng.
+    """
+    global rng
+    patient_ids, created_at, seed = args
+    if seed is not None:
+        rng = np.random.default_rng(seed)
+    pids = expand_ids(patient_ids, rng.integers(1, 5, len(patient_ids)).tolist())
+    n = len(pids)
+    encounter_types = pick(["A&E", "OPD", "Ward", "Telehealth"], n)
+    complaints = pick([
+        "Chest pain", "Shortness of breath", "Headache",
+        "Abdominal pain", "Fever", "Routine check-up"
+    ], n)
+    doctor_names = pick(["Dr Smith", "Dr Brown", "Dr Ahmed", "Dr Taylor"], n)
+    dispositions = pick(["Discharged", "Admitted", "Referred"], n)
+    hpi_days = rng.integers(1, 15, n).tolist()
+    encounter_dates = random_datetimes_in_last_year(n)
+
+    hpis = [f"{complaint} for {days} days." for complaint, days in zip(complaints, hpi_days)]
+    encounter_rows = list(zip(
+        pids, encounter_dates, encounter_types, complaints,
+        hpis, doctor_names, dispositions, [created_at] * n,
+    ))
+
+    # Vitals, one row per encounter, sampled column by column
+    vitals_rows = list(zip(
+        range(n),
+        encounter_dates,
+        rng.integers(90, 181, n).tolist(),                    # systolic
+        rng.integers(60, 111, n).tolist(),                    # diastolic
+        rng.integers(55, 121, n).tolist(),                    # heart rate
+        rng.integers(12, 31, n).tolist(),                     # respiratory rate
+        np.round(rng.uniform(36.0, 40.5, n), 1).tolist(),     # temperature
+        np.round(rng.uniform(88.0, 100.0, n), 1).tolist(),    # SpO2
+        np.round(rng.uniform(45.0, 120.0, n), 1).tolist(),    # weight
+        np.round(rng.uniform(150.0, 200.0, n), 1).tolist(),   # height
+    ))
+
+    # Labs (some encounters may have labs): 1-4 tests on ~70% of encounters
+    num_tests = np.where(rng.random(n) < 0.7, rng.integers(1, 5, n), 0).tolist()
+    lab_positions = expand_ids(range(n), num_tests)
+    lab_tests = pick(LAB_TESTS, len(lab_positions))
+    # rough plausible-ish value per test, as a string
+    ranges = [LAB_VALUE_RANGES.get(test_name, (1, 100)) for test_name, _, _ in lab_tests]
+    low, high = np.array(ranges, dtype=float).reshape(-1, 2).T
+    lab_values = [str(v) for v in np.round(rng.uniform(low, high), 1).tolist()]
+    lab_rows = [
+        (pos, test_name, value, units, ref, encounter_dates[pos])
+        for pos, (test_name, units, ref), value in zip(lab_positions, lab_tests, lab_values)
+    ]
+
+    return encounter_rows, vitals_rows, lab_rows
 
 
 def seed_encounters_vitals_labs(conn, patient_ids):
+    """
+    Generate encounters in chunks of GENERATOR_CHUNK_PATIENTS patients and
+    write each chunk as it arrives. With more than one chunk the generation
+    runs in a GENERATOR_WORKERS process pool, overlapping with the inserts;
+    this connection stays the only writer.
+    """
     cur = conn.cursor()
-    for pid in patient_ids:
-        num_encounters = random.randint(1, 4)
-        for _ in range(num_encounters):
-            encounter_date = random_datetime_in_last_year()
-            encounter_type = random.choice(["A&E", "OPD", "Ward", "Telehealth"])
-            complaint = random.choice([
-                "Chest pain", "Shortness of breath", "Headache",
-                "Abdominal pain", "Fever", "Routine check-up"
-            ])
-            hpi = f"{complaint} for {random.randint(1, 14)} days."
-            doctor_name = random.choice(["Dr Smith", "Dr Brown", "Dr Ahmed", "Dr Taylor"])
-            disposition = random.choice(["Discharged", "Admitted", "Referred"])
-
-            cur.execute(
-                """
-                INSERT INTO encounters (
-                    patient_id, encounter_date, encounter_type,
-                    presenting_complaint, history_of_present_illness,
-                    doctor_name, disposition
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (pid, encounter_date, encounter_type, complaint, hpi, doctor_name, disposition),
+    created_at = utc_now()
+    starts = range(0, len(patient_ids), GENERATOR_CHUNK_PATIENTS)
+
+    pool = None
+    if len(starts) > 1:
+        # Per-chunk seeds drawn from rng keep pooled runs reproducible from
+        # SEED; imap (not imap_unordered) keeps the encounter ids stable too
+        seeds = rng.integers(0, 2**63, len(starts)).tolist()
+        chunks = [
+            (patient_ids[i:i + GENERATOR_CHUNK_PATIENTS], created_at, seed)
+            for i, seed in zip(starts, seeds)
+        ]
+        pool = multiprocessing.Pool(GENERATOR_WORKERS)
+        results = pool.imap(generate_encounters_chunk, chunks)
+    else:
+        results = map(generate_encounters_chunk, [(patient_ids, created_at, None)])
+
+    try:
+        for encounter_rows, vitals_rows, lab_rows in results:
+            cur.executemany(INSERT_ENCOUNTER_SQL, encounter_rows)
+            encounter_ids = inserted_ids(cur, len(encounter_rows))
+            cur.executemany(
+                INSERT_VITALS_SQL,
+                [(encounter_ids[pos], *rest) for pos, *rest in vitals_rows],
             )
-            encounter_id = cur.lastrowid
-
-            # Vitals
-            systolic = random.randint(90, 180)
-            diastolic = random.randint(60, 110)
-            hr = random.randint(55, 120)
-            rr = random.randint(12, 30)
-            temp = round(random.uniform(36.0, 40.5), 1)
-            spo2 = round(random.uniform(88.0, 100.0), 1)
-            weight = round(random.uniform(45.0, 120.0), 1)
-            height = round(random.uniform(150.0, 200.0), 1)
-
-            cur.execute(
-                """
-                INSERT INTO vitals (
-                    encounter_id, recorded_at, systolic_bp, diastolic_bp,
-                    heart_rate, respiratory_rate, temperature_c,
-                    oxygen_saturation, weight_kg, height_cm
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    encounter_id, encounter_date, systolic, diastolic,
-                    hr, rr, temp, spo2, weight, height,
-                ),
+            cur.executemany(
+                INSERT_LAB_RESULT_SQL,
+                [(encounter_ids[pos], *rest) for pos, *rest in lab_rows],
             )
-
-            # Labs (some encounters may have labs)
-            if random.random() < 0.7:
-                num_tests = random.randint(1, 4)
-                for _ in range(num_tests):
-                    test_name, units, ref = random.choice(LAB_TESTS)
-                    # generate rough plausible-ish value as string
-                    if test_name == "HbA1c":
-                        value = str(round(random.uniform(30, 90), 1))
-                    elif test_name == "Creatinine":
-                        value = str(round(random.uniform(50, 400), 1))
-                    elif test_name == "Hemoglobin":
-                        value = str(round(random.uniform(8, 18), 1))
-                    elif test_name == "WBC":
-                        value = str(round(random.uniform(2, 20), 1))
-                    elif test_name == "Platelets":
-                        value = str(round(random.uniform(50, 600), 1))
-                    else:
-                        value = str(round(random.uniform(1, 100), 1))
-
-                    cur.execute(
-                        """
-                        INSERT INTO lab_results (
-                            encounter_id, test_name, result_value,
-                            units, reference_range, result_date
-                        )
-                        VALUES (?, ?, ?, ?, ?, ?)
-                        """,
-                        (
-                            encounter_id, test_name, value,
-                            units, ref, encounter_date
-                        ),
-                    )
-    conn.commit()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 
 def main():
@@ -326,34 +442,68 @@ def main():
     if not db_file.exists():
         raise FileNotFoundError(f"{DB_PATH} not found. Run create_db.py first.")
 
-    conn = sqlite3.connect(DB_PATH)
+    disk = sqlite3.connect(DB_PATH)
+    # create_db.py already leaves the file in WAL mode; make sure of it
+    disk.execute("PRAGMA journal_mode = WAL;")
+
+    # Seed an in-memory copy of the database, so no insert, index rebuild or
+    # commit touches the disk, then write it back in one sequential backup.
+    # Run with the API stopped: writes made to clinic.db meanwhile are lost.
+    conn = sqlite3.connect(":memory:")
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    disk.backup(conn)
+    # Shared per-connection PRAGMAs (foreign keys, temp store, page cache)
+    configure_connection(conn)
 
     print("Seeding database with fictitious data...")
 
-    patient_ids = seed_patients(conn, num_patients=79)
-    print(f"Inserted {len(patient_ids)} patients.")
-
-    seed_social_history(conn, patient_ids)
-    print("Social history seeded.")
-
-    seed_conditions(conn, patient_ids)
-    print("Medical conditions seeded.")
-
-    seed_medications(conn, patient_ids)
-    print("Medications seeded.")
-
-    seed_allergies(conn, patient_ids)
-    print("Allergies seeded.")
-
-    seed_immunizations(conn, patient_ids)
-    print("Immunizations seeded.")
-
-    seed_encounters_vitals_labs(conn, patient_ids)
-    print("Encounters, vitals, and lab results seeded.")
-
+    # Trusted data: skip per-row foreign key checks and index maintenance,
+    # then rebuild the indexes in one pass (foreign_keys can only change
+    # outside a transaction)
+    conn.execute("PRAGMA foreign_keys = OFF;")
+    drop_indexes(conn)
+    try:
+        # One transaction for the whole run: a single commit, and a failed
+        # seed leaves the database untouched
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            patient_ids = seed_patients(conn, num_patients=79)
+            print(f"Inserted {len(patient_ids)} patients.")
+
+            seed_social_history(conn, patient_ids)
+            print("Social history seeded.")
+
+            seed_conditions(conn, patient_ids)
+            print("Medical conditions seeded.")
+
+            seed_medications(conn, patient_ids)
+            print("Medications seeded.")
+
+            seed_allergies(conn, patient_ids)
+            print("Allergies seeded.")
+
+            seed_immunizations(conn, patient_ids)
+            print("Immunizations seeded.")
+
+            seed_encounters_vitals_labs(conn, patient_ids)
+            print("Encounters, vitals, and lab results seeded.")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        finalize_indexes(conn)
+        conn.execute("PRAGMA foreign_keys = ON;")
+    # Fresh statistics for every table and rebuilt index, so the API's first
+    # queries get index plans; optimize then records the analysis as current
+    conn.execute("ANALYZE;")
+    conn.execute("PRAGMA optimize;")
+
+    conn.backup(disk)
     conn.close()
+    # The copied header comes from a rollback-journal database; keep WAL
+    disk.execute("PRAGMA journal_mode = WAL;")
+    disk.close()
     print("Seeding complete.")
 
 
@@ -1,18 +1,88 @@
-import urllib.request
-import urllib.error
+import http.client
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-URL = "http://127.0.0.1:8000/patients"
+HOST = "127.0.0.1"
+PORT = 8000
+PATH = "/patients"
+TIMEOUT = 5
+HEADERS = {"Accept-Encoding": "gzip"}
 
-try:
-    with urllib.request.urlopen(URL, timeout=5) as response:
-        status = response.status
-        body = response.read().decode("utf-8")
-        print("Status:", status)
+# Smoke mode prints this much of the (decompressed) body and reads no further
+PREVIEW_BYTES = 1000
+READ_CHUNK = 1024
+
+# Load mode: `python test_api.py 1000` sends 1000 GETs from LOAD_WORKERS threads
+LOAD_WORKERS = 50
+
+# One keep-alive connection per worker thread, reused for all of its requests
+_local = threading.local()
+
+
+def get_connection() -> http.client.HTTPConnection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = http.client.HTTPConnection(HOST, PORT, timeout=TIMEOUT)
+    return conn
+
+
+def fetch(path: str = PATH):
+    """GET path over this thread's connection; returns (status, body bytes)."""
+    conn = get_connection()
+    try:
+        conn.request("GET", path, headers=HEADERS)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    except (http.client.HTTPException, OSError):
+        # Server closed the kept-alive socket; reconnect once
+        conn.close()
+        conn.request("GET", path, headers=HEADERS)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+
+
+def read_preview(resp, size: int = PREVIEW_BYTES) -> bytes:
+    """Up to `size` bytes of the body, decompressing gzip as chunks arrive."""
+    if resp.getheader("Content-Encoding") != "gzip":
+        return resp.read(size)
+    inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip framing
+    out = b""
+    while len(out) < size and (chunk := resp.read(READ_CHUNK)):
+        out += inflate.decompress(chunk, size - len(out))
+    return out
+
+
+def smoke():
+    # Own connection: the response is only partly read, so it can't be reused
+    conn = http.client.HTTPConnection(HOST, PORT, timeout=TIMEOUT)
+    try:
+        conn.request("GET", PATH, headers=HEADERS)
+        resp = conn.getresponse()
+        print("Status:", resp.status)
         print("Body:")
-        print(body[:1000])  # print first 1000 chars
-except urllib.error.HTTPError as e:
-    print("HTTP error:", e.code, e.reason)
-except urllib.error.URLError as e:
-    print("URL error:", e.reason)
-except Exception as e:
-    print("Other error:", repr(e))
+        print(read_preview(resp).decode("utf-8", errors="replace"))
+    except OSError as e:
+        print("Connection error:", e)
+    except Exception as e:
+        print("Other error:", repr(e))
+    finally:
+        conn.close()
+
+
+def load(n: int):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        statuses = list(pool.map(lambda _: fetch()[0], range(n)))
+    elapsed = time.perf_counter() - start
+    ok = statuses.count(200)
+    print(f"{n} requests, {ok} OK, {elapsed:.2f}s ({n / elapsed:.0f} req/s)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        load(int(sys.argv[1]))
+    else:
+        smoke()